@@ -1,14 +1,145 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import soundfile as sf
 from math import log2
-from scipy.fftpack import fft
+from functools import lru_cache
+
+
+referenceFrequency = 130.81
+# Bump whenever a change to the PCP computation changes its output, cached features of other versions are dropped
+pcpVersion = 1
+# Rows AudioBatch transforms at once. Small batches keep the spectra in cache, a single FFT over hundreds of rows is
+# slower than one FFT per clip
+batchRows = 8
+
+# PCP settings, the defaults give the original PCP over every bin but DC
+minFrequency = 0.0  # Hz, bins below it are left out (DC always is)
+maxFrequency = None  # Hz, None keeps every bin up to the Nyquist frequency
+harmonics = 0  # overtones of every bin whose expected energy is taken out of their pitch class, 0 turns it off
+harmonicWeight = 0.6  # the h-th harmonic is expected to have harmonicWeight ** (h - 1) of the energy of its bin
+estimateTuning = False  # move the pitch class boundaries by the tuning offset measured in every signal
+tuningResolution = 0.1  # semitones, measured offsets are rounded to it so that their filterbanks can be cached
+
+
+def pcpConfig():
+    # Everything that decides the value of a PCP, used to key cached features
+    return {"version": pcpVersion, "referenceFrequency": referenceFrequency, "minFrequency": minFrequency,
+            "maxFrequency": maxFrequency, "harmonics": harmonics, "harmonicWeight": harmonicWeight,
+            "estimateTuning": estimateTuning, "tuningResolution": tuningResolution}
+
+
+@lru_cache(maxsize=32)
+def pitchClassMap(N, sampleRate, referenceFreq=referenceFrequency):
+    # Pitch class of every FFT bin l in [0, N//2), computed once per (N, sampleRate, referenceFreq).
+    # Bin 0 (DC) has no pitch and is mapped to -1, same as Audio.M
+    bins = np.arange(N // 2)
+    pitchClasses = np.full(N // 2, -1, dtype=np.intp)
+    pitchClasses[1:] = np.round(12 * np.log2((sampleRate * bins[1:]) / (N * referenceFreq))).astype(np.intp) % 12
+    pitchClasses.setflags(write=False)
+    return pitchClasses
+
+
+def binRange(N, sampleRate, minFreq, maxFreq):
+    # First and last + 1 of the bins in [1, N//2) whose frequency lies within [minFreq, maxFreq]
+    first = max(1, int(np.ceil(minFreq * N / sampleRate)))
+    last = N // 2 if maxFreq is None else min(N // 2, int(np.floor(maxFreq * N / sampleRate)) + 1)
+    return first, max(first, last)
+
+
+@lru_cache(maxsize=32)
+def pcpFilterbank(N, sampleRate, referenceFreq=referenceFrequency, minFreq=0.0, maxFreq=None, harmonics=0,
+                  harmonicWeight=0.6):
+    # Sparse (12, N//2) matrix that turns the energy of the first N//2 FFT bins into a PCP with one mat-vec.
+    # Every bin within the frequency range adds its energy to its pitch class. With harmonics, every bin also
+    # takes harmonicWeight ** (h - 1) of its energy out of the pitch class of its h-th harmonic (h = 3, 5, 6, ...,
+    # octaves land in its own class) so that overtones count less; negative classes are clipped by the caller
+    # scipy takes a while to import, warmUp() imports it before the first PCP is needed
+    from scipy.sparse import csr_matrix
+
+    pitchClasses = pitchClassMap(N, sampleRate, referenceFreq)
+    first, last = binRange(N, sampleRate, minFreq, maxFreq)
+    bins = np.arange(first, last)
+
+    rows, columns, weights = [pitchClasses[bins]], [bins], [np.ones(len(bins))]
+    nyquist = sampleRate / 2 if maxFreq is None else min(maxFreq, sampleRate / 2)
+    for h in range(2, harmonics + 2):
+        if h & (h - 1) == 0:
+            continue
+        harmonicFrequencies = bins * sampleRate / N * h
+        inRange = harmonicFrequencies <= nyquist
+        rows.append(np.round(12 * np.log2(harmonicFrequencies[inRange] / referenceFreq)).astype(np.intp) % 12)
+        columns.append(bins[inRange])
+        weights.append(np.full(inRange.sum(), -harmonicWeight ** (h - 1)))
+
+    filterbank = csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))),
+                            shape=(12, N // 2))
+    filterbank.sum_duplicates()
+    return filterbank
+
+
+@lru_cache(maxsize=32)
+def tuningPhasors(N, sampleRate, referenceFreq=referenceFrequency, minFreq=0.0, maxFreq=None):
+    # exp(2 pi i d) of the deviation d (in semitones) of every bin from its nearest pitch, zero outside the range
+    first, last = binRange(N, sampleRate, minFreq, maxFreq)
+    bins = np.arange(first, last)
+    semitones = 12 * np.log2(bins * sampleRate / (N * referenceFreq))
+    phasors = np.zeros(N // 2, dtype=np.complex128)
+    phasors[first:last] = np.exp(2j * np.pi * (semitones - np.round(semitones)))
+    phasors.setflags(write=False)
+    return phasors
+
+
+def tuningOffset(energy, N, sampleRate, referenceFreq=referenceFrequency, minFreq=0.0, maxFreq=None,
+                 resolution=tuningResolution):
+    # Tuning of the signal in semitones from referenceFreq, in [-0.5, 0.5]: the energy weighted circular mean of
+    # the deviations of the bins from their nearest pitch, rounded to resolution. energy is (N//2,) or (n, N//2)
+    phasors = tuningPhasors(N, sampleRate, referenceFreq, minFreq, maxFreq)
+    offset = np.angle(np.asarray(energy) @ phasors) / (2 * np.pi)
+    return np.round(offset / resolution) * resolution
+
+
+def pcpFromEnergy(energy, N, sampleRate):
+    # PCPs of the energy of the first N//2 bins of one (N//2,) or several (n, N//2) signals, with the module settings
+    energy = np.asarray(energy)
+    single = energy.ndim == 1
+    energy = np.atleast_2d(energy)
+
+    if estimateTuning:
+        # Signals with the same rounded offset share one filterbank
+        offsets = np.atleast_1d(tuningOffset(energy, N, sampleRate, referenceFrequency, minFrequency, maxFrequency))
+        pcp = np.empty((len(energy), 12))
+        for offset in np.unique(offsets):
+            rows = offsets == offset
+            filterbank = pcpFilterbank(N, sampleRate, referenceFrequency * 2 ** (offset / 12), minFrequency,
+                                       maxFrequency, harmonics, harmonicWeight)
+            pcp[rows] = (filterbank @ energy[rows].T).T
+    else:
+        filterbank = pcpFilterbank(N, sampleRate, referenceFrequency, minFrequency, maxFrequency, harmonics,
+                                   harmonicWeight)
+        pcp = (filterbank @ energy.T).T
+
+    if harmonics:
+        np.maximum(pcp, 0, out=pcp)
+    return pcp[0] if single else pcp
+
+
+def padClips(clips, length=None):
+    # Stack clips of different lengths into one (n_clips, length) array, zero padding (or trimming) at the end
+    if length is None:
+        length = max(len(clip) for clip in clips)
+
+    batch = np.zeros((len(clips), length))
+    for i, clip in enumerate(clips):
+        clip = np.asarray(clip)[:length]
+        batch[i, :len(clip)] = clip
+
+    return batch
 
 
 class Audio():
     def __init__(self, audio=None, sampleRate=None, file=None):
         if audio is None and sampleRate is None:
-            self._frequency, self._samples = sf.read(file)
+            # sf.read returns the samples first and then the sample rate
+            self._samples, self._frequency = sf.read(file)
             self.readFile = True
         if file is None:
             self.audio = audio
@@ -28,6 +159,7 @@ class Audio():
             return self.audio
     
     def dft(self):
+        from scipy.fftpack import fft
         return fft(self.samples())
     
     def M(self, N, l, referenceFreq, sampleFreq):
@@ -38,19 +170,16 @@ class Audio():
     
     def calculatePCP(self, audioSignal):
         sampleFrequency = self.frequency()
-        referenceFrequency = 130.81
 
         N = len(audioSignal)
 
-        pcp = [0 for _ in range(12)]
+        energy = np.abs(np.asarray(audioSignal)[:N // 2]) ** 2
 
-        for p in range(12):
-            for l in range(N//2):
-                if p == self.M(N, l, referenceFrequency, sampleFrequency):
-                    pcp[p] += abs(audioSignal[l]) ** 2
+        # Sum the energy of every bin in the frequency range into its pitch class, skipping the DC bin
+        pcp = pcpFromEnergy(energy, N, sampleFrequency)
 
         # Normalizing PCP
-        pcpNormalized = [p / sum(pcp) for p in pcp]
+        pcpNormalized = (pcp / pcp.sum()).tolist()
 
         return pcpNormalized
     
@@ -65,6 +194,8 @@ class Audio():
         profiles = self.audioPCP
 
         if ax is None:
+            # matplotlib takes a while to import and is only needed for plots
+            import matplotlib.pyplot as plt
             fig, ax = plt.subplots()
 
         ax.bar(yPositions, profiles, align='center', alpha=0.5)
@@ -81,8 +212,46 @@ class Audio():
             ax.set_title(title)
 
 
+class AudioBatch():
+    # Companion of Audio for a stack of equal length (padded) clips that share one sample rate.
+    # Every row gets the same PCP as Audio(audio=row, sampleRate=sampleRate).getPCP()
+    def __init__(self, clips, sampleRate):
+        self.clips = np.atleast_2d(np.asarray(clips, dtype=np.float64))
+        self.sampleRate = sampleRate
 
+    def frequency(self):
+        return self.sampleRate
 
-        
-    
+    def samples(self):
+        return self.clips
 
+    def dft(self, clips=None):
+        # Only the first N//2 bins are used for the PCP, so a real FFT over all rows is enough
+        if clips is None:
+            clips = self.clips
+        return np.fft.rfft(clips, axis=1)
+
+    def calculatePCP(self, audioSignals, N=None):
+        if N is None:
+            N = self.clips.shape[1]
+
+        energy = np.abs(audioSignals[:, :N // 2]) ** 2
+
+        # One sparse product sums the bins of all clips into their pitch classes
+        pcp = pcpFromEnergy(energy, N, self.frequency())
+
+        # Normalizing PCP
+        return pcp / pcp.sum(axis=1, keepdims=True)
+
+    def getPCP(self, batchSize=None):
+        # batchSize rows are transformed at once (batchRows for None), which bounds the memory of the spectra
+        N = self.clips.shape[1]
+        if batchSize is None:
+            batchSize = batchRows
+
+        self.audioPCP = np.empty((len(self.clips), 12))
+        for start in range(0, len(self.clips), batchSize):
+            clips = self.clips[start:start + batchSize]
+            self.audioPCP[start:start + batchSize] = self.calculatePCP(self.dft(clips), N)
+
+        return self.audioPCP
@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import soundfile as sf
+from collections import namedtuple
+from audioStream import StreamingPCP
+from chordClassifier import ChordClassifier
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+# Recording analyzed when main() is run, e.g. a whole practice session
+recordingPath = os.path.join(baseDir, "chord_audio_files", "a", "a1.wav")
+csvFilePath = os.path.join(baseDir, "audioPCP.csv")
+memmapWav = True
+
+blockSize = 65536  # samples read at once, with frameSize this bounds the memory used for a file of any length
+frameSize = 16384
+hopSize = 4096
+
+# WAV subtypes that can be memory-mapped: numpy dtype and the scale to [-1, 1)
+memmapSubtypes = {"PCM_16": ("<i2", 2**15), "PCM_32": ("<i4", 2**31), "FLOAT": ("<f4", 1), "DOUBLE": ("<f8", 1)}
+
+# times: (n,) seconds at the end of every analyzed frame, pcps: (n, 12)
+PCPTimeline = namedtuple("PCPTimeline", ["times", "pcps"])
+# A run of frames classified as one chord, from the end of its first to the end of its last frame
+ChordSegment = namedtuple("ChordSegment", ["start", "end", "chord", "score"])
+
+
+def wavDataOffset(path):
+    # Byte offset of the samples of a RIFF/WAVE file, None if it has no data chunk where the header says
+    with open(path, "rb") as wavFile:
+        header = wavFile.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = wavFile.read(8)
+            if len(chunk) < 8:
+                return None
+            size = int.from_bytes(chunk[4:], "little")
+            if chunk[:4] == b"data":
+                return wavFile.tell()
+            # Chunks are padded to an even size
+            wavFile.seek(size + (size & 1), 1)
+
+
+class AudioFileSource():
+    # Reads a sound file of any length block by block, so only one block is in memory at a time. With memmap,
+    # uncompressed PCM/float WAV files are memory-mapped instead and blocks are converted from the mapped samples;
+    # other formats fall back to soundfile's block reader. Blocks are float64, mono (channels are averaged).
+    def __init__(self, path, blockSize=blockSize, memmap=False):
+        self.path = path
+        self.blockSize = blockSize
+
+        info = sf.info(path)
+        self.sampleRate = info.samplerate
+        self.frames = info.frames
+        self.channels = info.channels
+
+        self.mapped = None
+        if memmap and info.format == "WAV" and info.subtype in memmapSubtypes:
+            offset = wavDataOffset(path)
+            if offset is not None:
+                dtype, self.scale = memmapSubtypes[info.subtype]
+                self.mapped = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(self.frames, self.channels))
+
+    def duration(self):
+        return self.frames / self.sampleRate
+
+    def blocks(self):
+        if self.mapped is None:
+            for block in sf.blocks(self.path, blocksize=self.blockSize, dtype="float64", always_2d=True):
+                yield block.mean(axis=1) if self.channels > 1 else block[:, 0]
+            return
+
+        for start in range(0, self.frames, self.blockSize):
+            block = self.mapped[start:start + self.blockSize]
+            block = block.mean(axis=1) if self.channels > 1 else block[:, 0].astype(np.float64)
+            yield block / self.scale if self.scale != 1 else block
+
+    def __iter__(self):
+        return self.blocks()
+
+
+def pcpTimeline(source, frameSize=frameSize, hopSize=hopSize, onsets=False):
+    # PCP of every hop (or of the frame after every strum) of a whole recording. source is an AudioFileSource or a
+    # path; only the ring buffer of StreamingPCP and one block are held, whatever the length of the recording
+    if isinstance(source, str):
+        source = AudioFileSource(source)
+
+    stream = StreamingPCP(source.sampleRate, frameSize, hopSize, historySize=1, onsets=onsets)
+    times, pcps = [], []
+    for time, pcp in stream.stream(source.blocks()):
+        times.append(time)
+        pcps.append(pcp)
+    return PCPTimeline(np.array(times), np.array(pcps).reshape(-1, 12))
+
+
+def chordTimeline(timeline, classifier, minFrames=1):
+    # Classify every frame of a PCPTimeline and merge consecutive frames of one chord into ChordSegments, the
+    # score of a segment is the mean cosine score of its frames. Runs shorter than minFrames are dropped
+    if not len(timeline.times):
+        return []
+    labels, scores, _ = classifier.classifyWithScores(timeline.pcps)
+
+    # Frames where the chord changes
+    starts = np.flatnonzero(np.concatenate([[True], labels[1:] != labels[:-1]]))
+    ends = np.append(starts[1:], len(labels))
+    return [ChordSegment(float(timeline.times[start]), float(timeline.times[end - 1]), str(labels[start]),
+                         float(scores[start:end].mean()))
+            for start, end in zip(starts, ends) if end - start >= minFrames]
+
+
+def main():
+    source = AudioFileSource(recordingPath, memmap=memmapWav)
+    timeline = pcpTimeline(source)
+    segments = chordTimeline(timeline, ChordClassifier.fromCSV(csvFilePath))
+    print(f"{source.duration():.1f} s, {len(timeline.times)} PCPs, {len(segments)} chord segments")
+    for segment in segments:
+        print(f"\t{segment.start:7.2f} - {segment.end:7.2f} s: {segment.chord} ({segment.score:.2f})")
+
+
+if __name__ == '__main__':
+    main()
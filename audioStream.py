@@ -0,0 +1,143 @@
+import time
+import numpy as np
+from collections import deque
+from audio import pcpFromEnergy
+from onsets import OnsetDetector
+
+
+class StreamingPCP():
+    # Frame-wise PCP for live audio. Blocks of any size are pushed into a fixed ring buffer and one PCP is
+    # produced every hopSize samples over the last frameSize samples (Hann windowed).
+    # With onsets, the hops only look for strums (see onsets.py) and one PCP is produced over the frameSize samples
+    # that follow every strum, which skips the silence and the decay between strums.
+    def __init__(self, sampleRate=44100, frameSize=8192, hopSize=2048, historySize=1000, onsets=False):
+        if hopSize > frameSize:
+            raise ValueError("hopSize can not be larger than frameSize")
+        if onsets and frameSize % hopSize:
+            raise ValueError("frameSize has to be a multiple of hopSize to analyze the frames after onsets")
+
+        self.sampleRate = sampleRate
+        self.frameSize = frameSize
+        self.hopSize = hopSize
+        # Strums closer together than one frame are one strum
+        self.onsetDetector = OnsetDetector(refractoryHops=frameSize // hopSize) if onsets else None
+
+        # Everything a hop needs is allocated once here
+        self.window = np.hanning(frameSize)
+        self.ringBuffer = np.zeros(frameSize)
+        self.frame = np.empty(frameSize)
+
+        self.writePosition = 0
+        self.samplesSeen = 0
+        self.samplesToNextHop = hopSize if onsets else frameSize
+        self.hopEnergy = 0.0
+        # Sample counts at which the frame after an onset is complete
+        self.pendingFrames = deque()
+
+        # Wall clock and CPU seconds of the last historySize hops
+        self.hopTimes = deque(maxlen=historySize)
+        self.hopCPUTimes = deque(maxlen=historySize)
+
+    def reset(self):
+        self.ringBuffer[:] = 0
+        self.writePosition = 0
+        self.samplesSeen = 0
+        self.samplesToNextHop = self.frameSize
+        self.hopEnergy = 0.0
+        self.pendingFrames.clear()
+        if self.onsetDetector is not None:
+            self.onsetDetector.reset()
+            self.samplesToNextHop = self.hopSize
+        self.hopTimes.clear()
+        self.hopCPUTimes.clear()
+
+    def warmUp(self):
+        # Import the FFT and filterbank code and build the filterbank of this frame size before the first hop
+        self.calculatePCP()
+
+    def write(self, samples):
+        # Copy samples into the ring buffer, wrapping around at the end
+        start = self.writePosition
+        end = start + len(samples)
+        if end <= self.frameSize:
+            self.ringBuffer[start:end] = samples
+        else:
+            split = self.frameSize - start
+            self.ringBuffer[start:] = samples[:split]
+            self.ringBuffer[:end - self.frameSize] = samples[split:]
+        self.writePosition = end % self.frameSize
+        self.samplesSeen += len(samples)
+        if self.onsetDetector is not None:
+            self.hopEnergy += np.dot(samples, samples)
+
+    def calculatePCP(self):
+        # The oldest sample sits at writePosition, unroll the ring buffer into the windowed frame
+        oldest = self.frameSize - self.writePosition
+        np.multiply(self.ringBuffer[self.writePosition:], self.window[:oldest], out=self.frame[:oldest])
+        np.multiply(self.ringBuffer[:self.writePosition], self.window[oldest:], out=self.frame[oldest:])
+
+        spectrum = np.fft.rfft(self.frame)
+        energy = np.abs(spectrum[:self.frameSize // 2]) ** 2
+        pcp = pcpFromEnergy(energy, self.frameSize, self.sampleRate)
+
+        total = pcp.sum()
+        if total > 0:
+            pcp /= total
+        return pcp
+
+    def process(self, block):
+        # Push one block of mono samples and yield (time in seconds, PCP) for every hop it completes
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+
+        while len(block):
+            # Never write more than the remainder of the current hop, so no hop gets skipped
+            take = min(len(block), self.samplesToNextHop)
+            self.write(block[:take])
+            block = block[take:]
+            self.samplesToNextHop -= take
+
+            if self.samplesToNextHop == 0:
+                self.samplesToNextHop = self.hopSize
+
+                if self.onsetDetector is not None:
+                    # The frame after an onset starts with the hop the onset was found in
+                    if self.onsetDetector.update(self.hopEnergy / self.hopSize):
+                        self.pendingFrames.append(self.samplesSeen - self.hopSize + self.frameSize)
+                    self.hopEnergy = 0.0
+                    if not self.pendingFrames or self.pendingFrames[0] != self.samplesSeen:
+                        continue
+                    self.pendingFrames.popleft()
+
+                start, startCPU = time.perf_counter(), time.process_time()
+                pcp = self.calculatePCP()
+                self.hopTimes.append(time.perf_counter() - start)
+                self.hopCPUTimes.append(time.process_time() - startCPU)
+
+                yield self.samplesSeen / self.sampleRate, pcp
+
+    def stream(self, blocks):
+        # Run over an iterable of blocks, e.g. sf.blocks(...) or a queue fed by an audio callback
+        for block in blocks:
+            yield from self.process(block)
+
+    def hopBudget(self):
+        # Seconds of audio per hop, a hop must be processed faster than this to keep up in real time
+        return self.hopSize / self.sampleRate
+
+    def latencyStats(self):
+        if not self.hopTimes:
+            return None
+
+        hopTimes = np.array(self.hopTimes)
+        return {
+            "hops": len(hopTimes),
+            "meanMs": float(hopTimes.mean() * 1e3),
+            "p95Ms": float(np.percentile(hopTimes, 95) * 1e3),
+            "maxMs": float(hopTimes.max() * 1e3),
+            "cpuMeanMs": float(np.mean(self.hopCPUTimes) * 1e3),
+            "budgetMs": self.hopBudget() * 1e3,
+            # Fraction of one core used at real time input rate
+            "load": float(hopTimes.mean() / self.hopBudget()),
+        }
@@ -0,0 +1,162 @@
+import numpy as np
+import soundfile as sf
+import generateAudioDataset
+from os.path import join
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from audio import Audio
+from generateAudioDataset import dataDir, listWavFiles, applyReverb, addNoise, timeStretch, strumSegment
+
+seed = 0
+workers = 1  # processes computing samples, the samples and their order do not depend on it
+clipCacheSize = 64  # decoded clips kept per worker, bounds the memory of the stream
+
+# Augmentations a sample is drawn from and how likely each one is, "normal" is the unchanged clip
+augmentationWeights = {"normal": 1, "reverb": 1, "noise": 1, "stretch": 1}
+# Every parameter is drawn uniformly from its (low, high) range for every sample
+parameterRanges = {
+    "reverb": {"roomSize": (0.3, 0.95)},
+    "noise": {"noiseFactor": (0.01, 0.3)},
+    "stretch": {"stretchRate": (0.7, 1.3)},
+}
+
+# pcp: the 12 pitch class profile values, label: upper case chord label, augmentation: dict with the sample index,
+# the source file, the augmentation name and the drawn parameters, enough to compute the same sample again
+AugmentedSample = namedtuple("AugmentedSample", ["pcp", "label", "augmentation"])
+
+
+def checkSaveAugmented():
+    # saveAugmented writes one file per source clip, every sample drawn from that clip would overwrite it
+    if generateAudioDataset.saveAugmented:
+        raise ValueError("saveAugmented is not supported by AugmentationStream, set "
+                         "generateAudioDataset.saveAugmented = False")
+
+
+class AugmentationStream():
+    # Endless, lazily computed augmented samples of the .wav files under directory. Nothing is written to disk and
+    # only clipCacheSize decoded clips are kept, so any number of samples can be drawn at constant memory.
+    #
+    # Sample i only depends on (seed, i): it draws its file, augmentation and parameters from its own generator.
+    # The same seed gives the same stream, and samples(start=...) continues a stream where it was left.
+    def __init__(self, directory=dataDir, seed=seed, weights=None, ranges=None, clipCacheSize=clipCacheSize):
+        checkSaveAugmented()
+        self.directory = directory
+        self.seed = seed
+        self.wavFiles = listWavFiles(directory)
+        if not self.wavFiles:
+            raise ValueError("No .wav files found under " + directory)
+
+        weights = augmentationWeights if weights is None else weights
+        self.names = [name for name, weight in weights.items() if weight > 0]
+        self.probabilities = np.array([weights[name] for name in self.names], dtype=np.float64)
+        self.probabilities /= self.probabilities.sum()
+        self.ranges = parameterRanges if ranges is None else ranges
+
+        # One reverb for the whole stream, its room size is set for every sample
+        from pedalboard import Reverb
+        self.reverb = Reverb()
+        self.clipCacheSize = clipCacheSize
+        self.clips = OrderedDict()
+
+    def clip(self, chordLabel, file):
+        # Decoded clip, least recently used clips are dropped
+        key = (chordLabel, file)
+        if key in self.clips:
+            self.clips.move_to_end(key)
+            return self.clips[key]
+
+        clip = sf.read(join(self.directory, chordLabel, file))
+        self.clips[key] = clip
+        if len(self.clips) > self.clipCacheSize:
+            self.clips.popitem(last=False)
+        return clip
+
+    def describe(self, index):
+        # Augmentation descriptor of sample index, without computing the sample
+        rng = np.random.default_rng([self.seed, index])
+        chordLabel, file = self.wavFiles[rng.integers(len(self.wavFiles))]
+        name = self.names[rng.choice(len(self.names), p=self.probabilities)]
+        augmentation = {"index": index, "source": chordLabel + "/" + file, "name": name}
+        for parameter, (low, high) in self.ranges.get(name, {}).items():
+            augmentation[parameter] = float(rng.uniform(low, high))
+        if name == "noise":
+            augmentation["noiseSeed"] = int(rng.integers(2**32))
+        return augmentation
+
+    def augment(self, audio, sampleRate, augmentation):
+        name = augmentation["name"]
+        if name == "reverb":
+            return applyReverb(audio, sampleRate, None, augmentation["roomSize"], reverb=self.reverb)
+        if name == "noise":
+            return addNoise(audio, sampleRate, None, augmentation["noiseFactor"], seed=augmentation["noiseSeed"])
+        if name == "stretch":
+            return timeStretch(audio, sampleRate, None, augmentation["stretchRate"])
+        return Audio(audio=audio, sampleRate=sampleRate)
+
+    def sample(self, index):
+        augmentation = self.describe(index)
+        chordLabel, file = augmentation["source"].split("/")
+        audio, sampleRate = self.clip(chordLabel, file)
+        augmented = self.augment(audio, sampleRate, augmentation)
+        pcp = Audio(audio=strumSegment(augmented.samples()), sampleRate=sampleRate).getPCP()
+        return AugmentedSample(pcp, chordLabel.upper(), augmentation)
+
+    def samples(self, count=None, start=0):
+        # count samples starting at sample start, None never stops
+        index = start
+        while count is None or index < start + count:
+            yield self.sample(index)
+            index += 1
+
+
+# The stream of this worker process, created once by initWorker so that every worker keeps one reverb and clip cache
+workerStream = None
+
+
+def initWorker(directory, seed, weights, ranges):
+    global workerStream
+    workerStream = AugmentationStream(directory, seed, weights, ranges)
+
+
+def workerSamples(indices):
+    return [workerStream.sample(index) for index in indices]
+
+
+def parallelSamples(count=None, start=0, directory=dataDir, seed=seed, weights=None, ranges=None, workers=workers,
+                    chunkSize=16):
+    # samples() spread over worker processes. Samples come out in index order and equal those of a single process
+    # stream with the same seed; at most two chunks per worker are computed ahead of the consumer
+    checkSaveAugmented()
+    if workers == 1:
+        yield from AugmentationStream(directory, seed, weights, ranges).samples(count, start)
+        return
+
+    def chunks():
+        first = start
+        while count is None or first < start + count:
+            last = first + chunkSize if count is None else min(first + chunkSize, start + count)
+            yield range(first, last)
+            first = last
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker,
+                             initargs=(directory, seed, weights, ranges)) as executor:
+        pending = []
+        chunkIterator = chunks()
+        for indices in chunkIterator:
+            pending.append(executor.submit(workerSamples, indices))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            yield from pending.pop(0).result()
+            indices = next(chunkIterator, None)
+            if indices is not None:
+                pending.append(executor.submit(workerSamples, indices))
+
+
+def main():
+    for sample in parallelSamples(count=8):
+        print(sample.label, sample.augmentation, np.round(sample.pcp, 3))
+
+
+if __name__ == '__main__':
+    main()
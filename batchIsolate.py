@@ -0,0 +1,184 @@
+import os
+import csv
+import cv2
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from image import Image
+from framePipeline import imageExtensions
+from guitarFunctions import neckAngle, rotate, isolateNeckWithReason
+from fretboardParams import loadProfile
+
+# Video files and image directories (searched recursively) to isolate the fretboard in
+inputPaths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "chords")]
+outputDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "isolated_fretboards")
+manifestName = "manifest.csv"
+workers = os.cpu_count()
+chunkSize = 32  # frames (or image files) one task decodes and processes
+frameStep = 1  # process every frameStep-th frame of a video
+fretboardProfile = None  # name of a profile saved by calibration.py, None for the default thresholds
+
+videoExtensions = (".mp4", ".avi", ".mov", ".mkv")
+manifestColumns = ["source", "frame", "status", "reason", "angle", "firstH", "lastH", "firstV", "lastV", "crop"]
+
+# Detection thresholds of a worker process, loaded once by initWorker
+workerParams = None
+
+
+def initWorker(profile):
+    global workerParams
+    workerParams = loadProfile(profile) if profile else None
+
+
+def listImages(directory):
+    # Image files under directory, relative to it and sorted
+    images = []
+    for root, _, files in os.walk(directory):
+        images += [os.path.relpath(os.path.join(root, file), directory) for file in files
+                   if file.lower().endswith(imageExtensions)]
+    return sorted(images)
+
+
+def videoFrameCount(path):
+    capture = cv2.VideoCapture(path)
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return count
+
+
+def createTasks(paths=inputPaths, chunkSize=chunkSize, frameStep=frameStep):
+    # ("images", directory, files) and ("video", path, firstFrame, lastFrame, frameStep) chunks of all inputs
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path):
+            images = listImages(path)
+            tasks += [("images", path, images[i:i + chunkSize]) for i in range(0, len(images), chunkSize)]
+        elif path.lower().endswith(videoExtensions):
+            count = videoFrameCount(path)
+            frames = chunkSize * frameStep
+            tasks += [("video", path, start, min(start + frames, count), frameStep) for start in range(0, count, frames)]
+        else:
+            raise ValueError(f"{path} is neither a directory nor a video file")
+    return tasks
+
+
+def taskFrames(task):
+    # (source, frame number, crop path relative to outputDir, frame) of every frame of a task, decoded one by one
+    if task[0] == "images":
+        _, directory, files = task
+        name = os.path.basename(os.path.normpath(directory))
+        for file in files:
+            yield os.path.join(directory, file), None, os.path.join(name, file), cv2.imread(os.path.join(directory, file))
+    else:
+        _, path, firstFrame, lastFrame, frameStep = task
+        name = os.path.splitext(os.path.basename(path))[0]
+        capture = cv2.VideoCapture(path)
+        # Seek once, then decode the chunk sequentially
+        capture.set(cv2.CAP_PROP_POS_FRAMES, firstFrame)
+        for index in range(firstFrame, lastFrame):
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if (index - firstFrame) % frameStep == 0:
+                yield path, index, os.path.join(name, f"{index:06d}.jpg"), frame
+        capture.release()
+
+
+def isolateFrame(frame, params=None):
+    # Rotation angle, rotated Image, box (or None) and rejection reason of one frame
+    if frame is None:
+        return 0, None, None, "unreadable"
+    image = Image(image=frame)
+    if not image:
+        return 0, None, None, "emptyImage"
+    angle = neckAngle(image, params=params)
+    rotatedImage = Image(image=rotate(image.image, -angle))
+    box, reason = isolateNeckWithReason(rotatedImage, params=params)
+    return angle, rotatedImage, box, reason
+
+
+def processChunk(task, outputDirectory=outputDir):
+    # Isolate the fretboard in every frame of a task, write the crops and return their manifest rows. A frame that
+    # fails is rejected with the error as its reason instead of failing the whole batch
+    rows = []
+    for source, index, cropPath, frame in taskFrames(task):
+        row = {"source": source, "frame": "" if index is None else index}
+        try:
+            row.update(processFrame(frame, cropPath, outputDirectory))
+        except Exception as error:
+            row.update(status="rejected", reason=f"error: {type(error).__name__}: {error}")
+        rows.append(row)
+    return rows
+
+
+def processFrame(frame, cropPath, outputDirectory=outputDir):
+    # Manifest columns of one frame, its crop is written under outputDirectory
+    angle, rotatedImage, box, reason = isolateFrame(frame, workerParams)
+    row = {"status": "rejected" if box is None else "ok", "reason": reason or "", "angle": round(angle, 3)}
+    if box is None:
+        return row
+
+    firstH, lastH, firstV, lastV = (int(value) for value in box)
+    row.update(firstH=firstH, lastH=lastH, firstV=firstV, lastV=lastV)
+    # The same crop as the interactive entry points save, clamped to the frame
+    height, width = rotatedImage.image.shape[:2]
+    crop = rotatedImage.image[max(0, firstH - 15):min(height, lastH + 15), max(0, firstV - 15):min(width, lastV + 15)]
+    if crop.size == 0:
+        row.update(status="rejected", reason="emptyCrop")
+        return row
+
+    outputPath = os.path.join(outputDirectory, cropPath)
+    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+    if not cv2.imwrite(outputPath, crop):
+        raise OSError(f"could not write {outputPath}")
+    row["crop"] = cropPath
+    return row
+
+
+def saveManifest(rows, path):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=manifestColumns, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def batchIsolate(paths=inputPaths, outputDirectory=outputDir, workers=workers, chunkSize=chunkSize,
+                 frameStep=frameStep, profile=fretboardProfile):
+    # Isolate the fretboard in every frame of the inputs over `workers` processes. Crops are written under
+    # outputDirectory together with a manifest of every frame: its box or why it was rejected
+    tasks = createTasks(paths, chunkSize, frameStep)
+    results = [None] * len(tasks)
+    os.makedirs(outputDirectory, exist_ok=True)
+    start = time.perf_counter()
+
+    if workers == 1:
+        initWorker(profile)
+        for i, task in enumerate(tasks):
+            results[i] = processChunk(task, outputDirectory)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(profile,)) as executor:
+            futures = {executor.submit(processChunk, task, outputDirectory): i for i, task in enumerate(tasks)}
+            for done, future in enumerate(as_completed(futures)):
+                results[futures[future]] = future.result()
+                print(f"\r{done + 1}/{len(tasks)} chunks", end="", flush=True)
+            print()
+
+    # Chunks are put back in input order, so the manifest does not depend on the number of workers
+    rows = [row for chunkRows in results for row in chunkRows]
+    saveManifest(rows, os.path.join(outputDirectory, manifestName))
+
+    elapsed = time.perf_counter() - start
+    reasons = Counter(row["reason"] for row in rows if row["status"] == "rejected")
+    found = sum(row["status"] == "ok" for row in rows)
+    print(f"{found} of {len(rows)} frames isolated in {elapsed:.1f} s ({len(rows) / elapsed:.1f} frames/s)")
+    for reason, count in reasons.most_common():
+        print(f"\t{reason}: {count}")
+    return rows
+
+
+def main():
+    batchIsolate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,614 @@
+import os
+import sys
+import cv2
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from collections import Counter
+import audio
+from math import log2
+from audio import Audio, AudioBatch
+from audioStream import StreamingPCP
+from onsets import onsetWindow
+from chordClassifier import ChordClassifier
+from image import Image
+from guitarFunctions import rotateNeck, isolateNeck, bridgePresent, binarize, threshold, verticalKernel
+from fretboardGrid import horizontalPositions, verticalPositions, positionBounds
+from fretboardTracker import FretboardTracker
+from fretboardParams import defaultParams, scaledParams
+from generateAudioDataset import applyReverb, addNoise, timeStretch
+from fusion import FusionEngine
+
+# Directory containing the .wav files
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chord_audio_files")
+# Fretboard crops captured by generateImageDataset
+imageDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chords")
+csvFilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audioPCP.csv")
+# Every run writes its timings and outputs to resultsPath and compares them to the ones in baselinePath.
+# Set updateBaseline = True to make this run the new baseline
+resultsPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.json")
+baselinePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+updateBaseline = False
+# A timing this many times the baseline is reported as a regression. Timings are divided by the time of
+# calibrationWorkload measured in the same run first, so a baseline recorded on a faster or slower machine compares
+# the code and not the machine
+regressionThreshold = 1.5
+# Timings whose name starts with one of these are noisier (subprocesses, librosa, thread scheduling, large FFT buffers)
+# and get their own threshold
+timingTolerances = {"startup.": 3.0, "augmentation.": 2.5, "streamingPCP.": 2.5,
+                    "pcp.batched": 2.5, "pcp.perClip": 2.5}
+
+# Timings (name -> seconds) and outputs (name -> value) of the current run, compared against the baseline
+suiteResults = {"timings": {}, "checks": {}}
+
+
+def calibrationWorkload(size=(480, 640), fftSize=2**16, seed=0):
+    # A fixed mix of the OpenCV, numpy and pure Python work the benchmarks do, to measure how fast this machine is
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, size, dtype=np.uint8)
+    signal = rng.standard_normal(fftSize)
+
+    def workload():
+        for _ in range(10):
+            cv2.threshold(cv2.Sobel(image, cv2.CV_8U, 1, 0), 100, 255, cv2.THRESH_BINARY)
+        for _ in range(5):
+            np.abs(np.fft.rfft(signal))
+        sum(i * i for i in range(100000))
+
+    return workload
+
+
+def measureCalibration():
+    seconds = timeIt(calibrationWorkload(), repeat=10)
+    suiteResults["calibrationSeconds"] = min(suiteResults.get("calibrationSeconds", float("inf")), seconds)
+    return seconds
+
+
+def timingThreshold(name):
+    for prefix, tolerance in timingTolerances.items():
+        if name.startswith(prefix):
+            return tolerance
+    return regressionThreshold
+
+
+def record(name, seconds):
+    suiteResults["timings"][name] = seconds
+
+
+def recordCheck(name, value):
+    # Output that later runs must reproduce, stored as plain JSON values
+    suiteResults["checks"][name] = json.loads(json.dumps(value, default=lambda value: np.asarray(value).tolist()))
+
+
+def referencePCP(audioSignal, sampleFrequency, referenceFrequency=130.81):
+    # The original per-bin Python loop of Audio.calculatePCP, kept to check and time the vectorized version against
+    N = len(audioSignal)
+
+    def M(l):
+        if l == 0:
+            return -1
+        return round(12 * log2((sampleFrequency * l)/(N * referenceFrequency))) % 12
+
+    pcp = [0 for _ in range(12)]
+
+    for p in range(12):
+        for l in range(N//2):
+            if p == M(l):
+                pcp[p] += abs(audioSignal[l]) ** 2
+
+    return [p / sum(pcp) for p in pcp]
+
+
+def timeIt(function, repeat=3):
+    # Best wall clock time out of `repeat` runs
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def fixtureFiles(directory=dataDir, perChord=1):
+    files = []
+    for chordLabel in sorted(os.listdir(directory)):
+        chordDir = os.path.join(directory, chordLabel)
+        if os.path.isdir(chordDir):
+            wavFiles = sorted(file for file in os.listdir(chordDir) if file.endswith(".wav"))
+            files += [os.path.join(chordDir, file) for file in wavFiles[:perChord]]
+    return files
+
+
+def fixtureFrames(directory=imageDir, perChord=5, border=0):
+    # The crops of chords/ as frames. With a border, every crop is grown by replicating its edge pixels so that
+    # there is some background around the neck like in a camera frame
+    frames = []
+    for chordLabel in sorted(os.listdir(directory)):
+        chordDir = os.path.join(directory, chordLabel)
+        files = sorted(os.listdir(chordDir), key=lambda file: int(os.path.splitext(file)[0]))[:perChord]
+        for file in files:
+            frame = cv2.imread(os.path.join(chordDir, file))
+            if border:
+                frame = cv2.copyMakeBorder(frame, border, border, border, border, cv2.BORDER_REPLICATE)
+            frames.append(frame)
+    return frames
+
+
+def benchmarkPCP(files):
+    print("PCP: loop vs vectorized")
+    for filePath in files:
+        audio, sampleRate = sf.read(filePath)
+        clip = Audio(audio=audio, sampleRate=sampleRate)
+        spectrum = clip.dft()
+
+        expected = referencePCP(spectrum, sampleRate)
+        actual = clip.calculatePCP(spectrum)
+        if not np.allclose(actual, expected, rtol=1e-9, atol=1e-12):
+            raise AssertionError("PCP mismatch for " + filePath)
+
+        loopTime = timeIt(lambda: referencePCP(spectrum, sampleRate), repeat=1)
+        vectorTime = timeIt(lambda: clip.calculatePCP(spectrum))
+        record(f"pcp.calculatePCP[{os.path.basename(filePath)}]", vectorTime)
+        print(f"\t{os.path.basename(filePath)} N={len(spectrum)}: loop {loopTime * 1e3:.1f} ms, "
+              f"vectorized {vectorTime * 1e3:.2f} ms ({loopTime / vectorTime:.0f}x)")
+
+
+def benchmarkBatchPCP(files):
+    print("PCP: one Audio per onset window vs one AudioBatch of all of them")
+    windows = np.array([onsetWindow(sf.read(filePath)[0]) for filePath in files])
+    sampleRate = sf.info(files[0]).samplerate
+
+    # Rows of one length get exactly the PCPs of Audio
+    expected = np.array([Audio(audio=window, sampleRate=sampleRate).getPCP() for window in windows])
+    if not np.allclose(AudioBatch(windows, sampleRate).getPCP(), expected, rtol=1e-9, atol=1e-12):
+        raise AssertionError("Batched PCP mismatch")
+
+    # Both take about as long, more runs than usual keep the timings apart from the noise
+    perClipTime = timeIt(lambda: [Audio(audio=window, sampleRate=sampleRate).getPCP() for window in windows],
+                         repeat=10)
+    batchTime = timeIt(lambda: AudioBatch(windows, sampleRate).getPCP(), repeat=10)
+    record("pcp.perClip[window]", perClipTime)
+    record("pcp.batched[window]", batchTime)
+    print(f"\t{windows.shape[0]} windows x {windows.shape[1]} samples: per clip {perClipTime * 1e3:.1f} ms, "
+          f"batched {batchTime * 1e3:.1f} ms ({perClipTime / batchTime:.1f}x)")
+
+
+def benchmarkStreamingPCP(files, blockSize=512):
+    print(f"Streaming PCP: {blockSize} sample blocks")
+    for frameSize, hopSize in ((4096, 1024), (8192, 2048), (16384, 4096)):
+        audio, sampleRate = sf.read(files[0])
+        stream = StreamingPCP(sampleRate, frameSize, hopSize)
+        for start in range(0, len(audio), blockSize):
+            for _ in stream.process(audio[start:start + blockSize]):
+                pass
+
+        stats = stream.latencyStats()
+        record(f"streamingPCP.hop[{frameSize}]", stats["meanMs"] / 1e3)
+        print(f"\tframe {frameSize} hop {hopSize}: mean {stats['meanMs']:.3f} ms, p95 {stats['p95Ms']:.3f} ms, "
+              f"budget {stats['budgetMs']:.1f} ms, load {stats['load'] * 100:.2f}% of one core")
+
+
+def benchmarkClassifier(csvFilePath=csvFilePath):
+    print("Chord classifier")
+    classifier = ChordClassifier.fromCSV(csvFilePath)
+    data = np.genfromtxt(csvFilePath, delimiter=",", skip_header=1, dtype=None, encoding=None)
+    pcps = np.array([list(row)[:12] for row in data], dtype=np.float32)
+    labels = np.array([row[12] for row in data])
+
+    # The fast path has to agree with a plain argmax over the cosine scores
+    expected = classifier.labelArray[np.argmax(classifier.scores(pcps), axis=1)]
+    if not np.array_equal(classifier.classify(pcps), expected):
+        raise AssertionError("classify does not match the argmax of scores")
+
+    for batchSize in (1, 64, len(pcps)):
+        batch = pcps[:batchSize]
+        batchTime = timeIt(lambda: classifier.classify(batch), repeat=20)
+        record(f"classifier.classify[{batchSize}]", batchTime)
+        print(f"\tbatch {batchSize}: {batchTime * 1e3:.3f} ms, {batchSize / (batchTime * 1e3):.0f} PCPs per ms")
+    print(f"\taccuracy on {csvFilePath}: {np.mean(classifier.classify(pcps) == labels) * 100:.1f}%")
+
+
+def isolateFrame(frame, debugImages=None):
+    rotatedImage = rotateNeck(Image(image=frame), debugImages)
+    return isolateNeck(rotatedImage, debugImages)
+
+
+def benchmarkFretboardAllocations(frames, rounds=5):
+    print("Fretboard isolation: debug overlays vs headless")
+    modes = (("debug", True), ("headless", False))
+    for name, debug in modes:
+        # Warm up the scratch buffers before measuring
+        isolateFrame(frames[0], {} if debug else None)
+
+        tracemalloc.start()
+        peaks = []
+        for frame in frames:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            isolateFrame(frame, {} if debug else None)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        print(f"\t{name}: peak {np.mean(peaks) / 2**20:.2f} MiB allocated per frame")
+
+    # The two modes take turns, so a slow stretch of the machine does not land on one of them only
+    frameTimes = {name: float("inf") for name, _ in modes}
+    for _ in range(rounds):
+        for name, debug in modes:
+            frameTime = timeIt(lambda: [isolateFrame(frame, {} if debug else None) for frame in frames], repeat=1)
+            frameTimes[name] = min(frameTimes[name], frameTime / len(frames))
+    for name, frameTime in frameTimes.items():
+        record(f"fretboard.isolateFrame.{name}", frameTime)
+        print(f"\t{name}: {frameTime * 1e3:.2f} ms per frame")
+
+
+def benchmarkEdgePreprocessing(frames):
+    print("Fretboard edges: binarize + dilate/erode vs threshold + close")
+    edges = [Image(image=frame).sobelX() for frame in frames]
+
+    # The old in place masks and separate dilate and erode, next to the fused threshold and close
+    def separate():
+        return [cv2.erode(cv2.dilate(binarize(edge.copy(), 100), verticalKernel), verticalKernel) for edge in edges]
+
+    def fused():
+        return [cv2.morphologyEx(threshold(edge, 100), cv2.MORPH_CLOSE, verticalKernel) for edge in edges]
+
+    mismatches = sum(not np.array_equal(a, b) for a, b in zip(separate(), fused()))
+    separateTime, fusedTime = timeIt(separate) / len(edges), timeIt(fused) / len(edges)
+    record("edges.separate", separateTime)
+    record("edges.fused", fusedTime)
+    recordCheck("edges.mismatches", int(mismatches))
+    print(f"\tbinarize + dilate/erode {separateTime * 1e3:.3f} ms, threshold + close {fusedTime * 1e3:.3f} ms "
+          f"per edge image, {mismatches} mismatches")
+
+
+def referenceLineBounds(lines, axis, slopeThreshold, diffThreshold, skip):
+    # The original Python loops of isolateNeck over the hough segments of one direction, kept to check and time
+    # positionBounds against. axis 1 keeps the y of horizontal segments, axis 0 the x of vertical ones
+    positions = []
+    for line in lines:
+        for x1, y1, x2, y2 in line:
+            if axis == 1 and abs(y2 - y1) < slopeThreshold:
+                positions += [y1, y2]
+            elif axis == 0 and abs(x1 - x2) < slopeThreshold:
+                positions += [x1, x2]
+
+    sortedPositions = list(sorted(positions))
+    diffs = [0]
+    first, last = 0, float("inf")
+
+    for i in range(len(sortedPositions) - 1):
+        diffs.append(sortedPositions[i + 1] - sortedPositions[i])
+
+    for i in range(len(diffs) - 1):
+        if diffs[i] < diffThreshold:
+            last = sortedPositions[i]
+            if i > skip and first == 0:
+                first = sortedPositions[i]
+
+    return first, last
+
+
+def houghSegments(frame):
+    # String and fret hough segments of a frame, found the way isolateNeck finds them
+    rotatedImage = rotateNeck(Image(image=frame))
+    stringLines = rotatedImage.probHoughTransform(threshold(rotatedImage.sobelY(), 100), 50, 0)
+    fretEdges = cv2.morphologyEx(threshold(rotatedImage.sobelX(), 100), cv2.MORPH_CLOSE, verticalKernel)
+    return stringLines, rotatedImage.probHoughTransform(fretEdges, 50, 0)
+
+
+def benchmarkGridExtraction(frames):
+    print("Fretboard grid: segment loops vs fretboardGrid")
+    segments = [lines for frame in frames for lines in houghSegments(frame) if lines is not None]
+    # (lines, axis, slope threshold, diff threshold, skip) of the string and fret passes
+    cases = [(lines, axis, *thresholds) for lines in segments
+             for axis, thresholds in ((1, (10, 6, 3)), (0, (5, 10, 2)))]
+
+    def vectorized(lines, axis, slopeThreshold, diffThreshold, skip):
+        positions = horizontalPositions if axis == 1 else verticalPositions
+        return positionBounds(positions(lines, slopeThreshold), diffThreshold, skip)
+
+    mismatches = sum(referenceLineBounds(*case) != vectorized(*case) for case in cases)
+    loopTime = timeIt(lambda: [referenceLineBounds(*case) for case in cases]) / len(cases)
+    vectorTime = timeIt(lambda: [vectorized(*case) for case in cases]) / len(cases)
+    record("grid.loops", loopTime)
+    record("grid.vectorized", vectorTime)
+    meanSegments = np.mean([len(lines) for lines in segments])
+    print(f"	{len(cases)} segment sets of {meanSegments:.0f} segments on average, {mismatches} mismatches")
+    print(f"	loops: {loopTime * 1e6:.1f} us, vectorized: {vectorTime * 1e6:.1f} us per segment set")
+
+
+def jitteredSequence(frame, length=100, seed=0):
+    # A "video" of one frame that drifts by up to a pixel per frame, with the offset of every frame
+    rng = np.random.default_rng(seed)
+    height, width = frame.shape[:2]
+    offset = np.zeros(2)
+    sequence, offsets = [], []
+    for _ in range(length):
+        offset += rng.integers(-1, 2, 2)
+        shift = np.float32([[1, 0, offset[0]], [0, 1, offset[1]]])
+        sequence.append(cv2.warpAffine(frame, shift, (width, height), borderMode=cv2.BORDER_REPLICATE))
+        offsets.append(offset.copy())
+    return sequence, offsets
+
+
+def benchmarkFretboardTracker(frames, sequences=3):
+    print("Fretboard isolation: every frame vs FretboardTracker on drifting sequences")
+    detectable = [frame for frame in frames if isolateFrame(frame)][:sequences]
+
+    for i, frame in enumerate(detectable):
+        firstH, lastH, firstV, lastV = isolateFrame(frame)
+        sequence, offsets = jitteredSequence(frame, seed=i)
+        truth = [(firstH + dy, lastH + dy, firstV + dx, lastV + dx) for dx, dy in offsets]
+
+        tracker = FretboardTracker()
+        methods = (("every frame", isolateFrame), ("tracked", lambda frame: tracker.update(Image(image=frame))[1]))
+        for name, isolate in methods:
+            start = time.perf_counter()
+            boxes = [isolate(frame) for frame in sequence]
+            frameTime = (time.perf_counter() - start) / len(sequence)
+            record(f"tracker.{name.replace(' ', '')}[{i}]", frameTime)
+
+            errors = [np.abs(np.subtract(box, expected)).mean() for box, expected in zip(boxes, truth) if box]
+            meanError = f"{np.mean(errors):.2f} px" if errors else "-"
+            print(f"\tsequence {i} {name}: {frameTime * 1e3:.2f} ms per frame, "
+                  f"found on {len(errors)}/{len(sequence)} frames, mean box error {meanError}")
+        print(f"\t\t{tracker.stats()}")
+
+
+def benchmarkAudioSizes(files, sizes=(2**12, 2**14, 2**15, None)):
+    print("Audio: dft and calculatePCP by clip length")
+    audio, sampleRate = sf.read(files[0])
+    for size in sizes:
+        clip = Audio(audio=audio[:size], sampleRate=sampleRate)
+        spectrum = clip.dft()
+        N = len(spectrum)
+        dftTime = timeIt(clip.dft, repeat=5)
+        pcpTime = timeIt(lambda: clip.calculatePCP(spectrum), repeat=5)
+        record(f"audio.dft[N={N}]", dftTime)
+        record(f"audio.calculatePCP[N={N}]", pcpTime)
+        print(f"	N={N}: dft {dftTime * 1e3:.3f} ms, calculatePCP {pcpTime * 1e3:.3f} ms")
+
+    # The PCP of every fixture file has to stay the same
+    pcps = {}
+    for filePath in files:
+        audio, sampleRate = sf.read(filePath)
+        pcps[os.path.basename(filePath)] = Audio(audio=audio, sampleRate=sampleRate).getPCP()
+    recordCheck("pcp", pcps)
+
+
+def benchmarkPCPSettings(files):
+    print("PCP settings: frequency range, harmonic suppression, tuning estimation")
+    settings = (("default", {}),
+                ("range", {"minFrequency": 60.0, "maxFrequency": 5000.0}),
+                ("harmonics", {"minFrequency": 60.0, "maxFrequency": 5000.0, "harmonics": 5}),
+                ("tuning", {"minFrequency": 60.0, "maxFrequency": 5000.0, "estimateTuning": True}))
+    defaults = {name: getattr(audio, name) for _, values in settings for name in values}
+
+    spectra = [Audio(audio=sf.read(filePath)[0], sampleRate=sf.info(filePath).samplerate) for filePath in files]
+    spectra = [(clip, clip.dft()) for clip in spectra]
+    try:
+        for name, values in settings:
+            for setting, value in values.items():
+                setattr(audio, setting, value)
+            pcpTime = timeIt(lambda: [clip.calculatePCP(spectrum) for clip, spectrum in spectra]) / len(spectra)
+            record(f"pcp.settings[{name}]", pcpTime)
+            print(f"\t{name}: {pcpTime * 1e3:.3f} ms per clip")
+            for setting, value in defaults.items():
+                setattr(audio, setting, value)
+    finally:
+        for setting, value in defaults.items():
+            setattr(audio, setting, value)
+
+
+def benchmarkOnsetWindow(files):
+    print("PCP: whole clip vs the window after the strum")
+    clips = [(sf.read(filePath)[0], sf.info(filePath).samplerate) for filePath in files]
+    fullTime = timeIt(lambda: [Audio(audio=clip, sampleRate=sampleRate).getPCP() for clip, sampleRate in clips])
+    windowTime = timeIt(lambda: [Audio(audio=onsetWindow(clip), sampleRate=sampleRate).getPCP()
+                                 for clip, sampleRate in clips])
+    record("pcp.wholeClip", fullTime / len(clips))
+    record("pcp.onsetWindow", windowTime / len(clips))
+    print(f"\twhole clip {fullTime / len(clips) * 1e3:.2f} ms, onset window {windowTime / len(clips) * 1e3:.2f} ms "
+          f"per clip ({fullTime / windowTime:.1f}x)")
+
+
+def benchmarkAugmentations(filePath):
+    print("Augmentations of one clip")
+    audio, sampleRate = sf.read(filePath)
+    augmentations = (("reverb", lambda: applyReverb(audio, sampleRate, filePath)),
+                     ("noise", lambda: addNoise(audio, sampleRate, filePath, seed=0)),
+                     ("stretch", lambda: timeStretch(audio, sampleRate, filePath)))
+
+    pcps = {}
+    for name, augment in augmentations:
+        augmentTime = timeIt(augment)
+        record(f"augmentation.{name}", augmentTime)
+        pcps[name] = augment().getPCP()
+        print(f"	{name}: {augmentTime * 1e3:.1f} ms for {len(audio) / sampleRate:.1f} s of audio")
+    recordCheck("augmentedPCP", pcps)
+
+
+# Run in a fresh interpreter by benchmarkStartup: creates the worker of isolateFretboardTest (and with it the hand
+# tracker), processes one frame and then the same frame again. Prints the seconds to the first processed frame, of
+# that frame alone and of the second one. The fretboard tracker is off so that both frames run the full detection
+firstFrameScript = """
+import time
+start = time.perf_counter()
+import cv2
+import isolateFretboardTest
+isolateFretboardTest.detectHands = {detectHands}
+isolateFretboardTest.warmUpModels = {warmUp}
+isolateFretboardTest.trackFretboard = False
+worker = isolateFretboardTest.FrameWorker()
+frame = cv2.copyMakeBorder(cv2.imread({path!r}), 90, 90, 90, 90, cv2.BORDER_REPLICATE)
+ready = time.perf_counter()
+isolateFretboardTest.processFrame(frame, worker)
+first = time.perf_counter()
+isolateFretboardTest.processFrame(frame, worker)
+print(first - start, first - ready, time.perf_counter() - first)
+"""
+
+
+def runFresh(code, repeat=3):
+    # Best wall clock time of running code in a new interpreter, and the output of that run
+    best, output = float("inf"), ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        if time.perf_counter() - start < best:
+            best, output = time.perf_counter() - start, result.stdout
+    return best, output
+
+
+def benchmarkStartup(modules=("guitarFunctions", "image", "audio", "generateAudioDataset", "isolateFretboardTest",
+                              "generateImageDataset", "fusion")):
+    print("Startup: importing the entry points in a fresh interpreter")
+    for module in modules:
+        importTime, _ = runFresh("import " + module)
+        record(f"startup.import[{module}]", importTime)
+        print(f"\t{module}: {importTime * 1e3:.0f} ms")
+
+    # A crop the fretboard is found in, so that the frame also reaches the hand tracker
+    path = os.path.join(imageDir, "A", "6.jpg")
+    for detectHands, warmUp, name in ((True, True, "hands"), (True, False, "handsCold"), (False, True, "noHands")):
+        totalTime, output = runFresh(firstFrameScript.format(path=path, detectHands=detectHands, warmUp=warmUp))
+        toFirstFrame, firstFrame, secondFrame = (float(value) for value in output.split())
+        record(f"startup.firstFrame[{name}]", toFirstFrame)
+        record(f"startup.firstFrameLatency[{name}]", firstFrame)
+        record(f"startup.secondFrameLatency[{name}]", secondFrame)
+        print(f"\tisolateFretboardTest {name}: first frame processed after {toFirstFrame * 1e3:.0f} ms "
+              f"({totalTime * 1e3:.0f} ms with the interpreter), the frame itself took {firstFrame * 1e3:.0f} ms, "
+              f"the next one {secondFrame * 1e3:.0f} ms")
+
+
+def benchmarkVisionSizes(frames, scales=(0.75, 1.0, 1.25, 1.5)):
+    print("Fretboard isolation by frame size")
+    for scale in scales:
+        # The expected fretboard size and line lengths are in pixels, so they are scaled with the frame
+        params = scaledParams(defaultParams, scale)
+        scaled = [cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) for frame in frames]
+        images = [Image(image=frame) for frame in scaled]
+        rotatedImages = [rotateNeck(image, params=params) for image in images]
+        height, width = scaled[0].shape[:2]
+
+        rotateTime = timeIt(lambda: [rotateNeck(image, params=params) for image in images]) / len(images)
+        isolateTime = timeIt(lambda: [isolateNeck(image, params=params) for image in rotatedImages]) / len(images)
+        record(f"vision.rotateNeck[{width}x{height}]", rotateTime)
+        record(f"vision.isolateNeck[{width}x{height}]", isolateTime)
+
+        boxes = [isolateNeck(image, params=params) for image in rotatedImages]
+        print(f"\t{width}x{height}: rotateNeck {rotateTime * 1e3:.2f} ms, isolateNeck {isolateTime * 1e3:.2f} ms, "
+              f"found on {sum(box is not None for box in boxes)}/{len(boxes)} frames")
+        # Crop coordinates have to stay the same
+        recordCheck(f"boxes[{scale}]", boxes)
+
+    # bridgePresent on the fretboard crops themselves, which all show the bridge
+    crops = fixtureFrames(perChord=10)
+    bridgeTime = timeIt(lambda: [bridgePresent(crop) for crop in crops], repeat=5) / len(crops)
+    record("vision.bridgePresent", bridgeTime)
+    recordCheck("bridgePresent", [bridgePresent(crop) for crop in crops])
+    print(f"	bridgePresent: {bridgeTime * 1e6:.1f} us per crop")
+
+
+def benchmarkFusion(audioPath=os.path.join(dataDir, "bm", "bm1.wav"), videoPath=os.path.join(imageDir, "B")):
+    print("Fusion: a B minor clip and the chords/B crops, as fast as possible")
+    start = time.perf_counter()
+    with FusionEngine(audioPath, videoPath, realTime=False) as engine:
+        decisions = list(engine.decisions())
+    fusionTime = time.perf_counter() - start
+    record("fusion.offline", fusionTime)
+
+    # Both modalities have to vote for the same minor chord label (see videoLabels in fusion.py)
+    joint = sorted(Counter((decision.audio[0], decision.video[0], decision.chord) for decision in decisions
+                           if decision.audio and decision.video).items())
+    recordCheck("fusion.jointDecisions", joint)
+    print(f"\t{len(decisions)} decisions in {fusionTime:.2f} s, by modality {engine.stats()['modalities']}, "
+          f"audio+video (audio, video, fused): {dict(joint)}")
+
+
+def sameCheck(actual, expected):
+    # Floats may differ in the last bits between machines, everything else has to be equal
+    if isinstance(expected, dict):
+        return (isinstance(actual, dict) and actual.keys() == expected.keys()
+                and all(sameCheck(actual[key], expected[key]) for key in expected))
+    if isinstance(expected, list):
+        return (isinstance(actual, list) and len(actual) == len(expected)
+                and all(sameCheck(a, e) for a, e in zip(actual, expected)))
+    if isinstance(expected, float) and isinstance(actual, (int, float)):
+        return bool(np.isclose(actual, expected, rtol=1e-9, atol=1e-12))
+    return actual == expected
+
+
+def compareBaseline(results, baseline):
+    # Returns the names of the checks whose output changed and of the timings that regressed. Timings are compared
+    # relative to the calibration time of their own run
+    failedChecks = [name for name, expected in baseline["checks"].items()
+                    if name in results["checks"] and not sameCheck(results["checks"][name], expected)]
+    speed = results.get("calibrationSeconds", 1.0) / baseline.get("calibrationSeconds", 1.0)
+    regressions = [name for name, seconds in baseline["timings"].items()
+                   if results["timings"].get(name, 0) > seconds * speed * timingThreshold(name)]
+    return failedChecks, regressions
+
+
+def saveResults(path):
+    suiteResults["environment"] = {"python": platform.python_version(), "numpy": np.__version__,
+                                   "opencv": cv2.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+                                   "host": platform.node()}
+    with open(path, "w") as file:
+        json.dump(suiteResults, file, indent=4, sort_keys=True)
+
+
+def main():
+    # Before and after the benchmarks, the faster of the two is kept
+    measureCalibration()
+    benchmarkPCP(fixtureFiles())
+    benchmarkBatchPCP(fixtureFiles(perChord=20))
+    benchmarkStreamingPCP(fixtureFiles())
+    benchmarkAudioSizes(fixtureFiles())
+    benchmarkPCPSettings(fixtureFiles())
+    benchmarkOnsetWindow(fixtureFiles())
+    benchmarkAugmentations(fixtureFiles()[0])
+    benchmarkClassifier()
+    benchmarkFretboardAllocations(fixtureFrames())
+    benchmarkVisionSizes(fixtureFrames(perChord=10, border=90))
+    benchmarkEdgePreprocessing(fixtureFrames(perChord=3, border=90))
+    benchmarkGridExtraction(fixtureFrames(perChord=100))
+    benchmarkFretboardTracker(fixtureFrames(perChord=30, border=90))
+    benchmarkFusion()
+    benchmarkStartup()
+    measureCalibration()
+    print(f"Calibration workload: {suiteResults['calibrationSeconds'] * 1e3:.1f} ms")
+
+    saveResults(resultsPath)
+    if updateBaseline or not os.path.exists(baselinePath):
+        saveResults(baselinePath)
+        print(f"Saved baseline {baselinePath}")
+        return
+
+    with open(baselinePath) as file:
+        baseline = json.load(file)
+    if "calibrationSeconds" not in baseline:
+        print("The baseline has no calibration time, set updateBaseline = True to record one")
+    elif baseline.get("environment", {}).get("host") != platform.node():
+        print(f"The baseline was recorded on another machine, timings are scaled by the calibration workload "
+              f"({suiteResults['calibrationSeconds'] / baseline['calibrationSeconds']:.2f}x)")
+    failedChecks, regressions = compareBaseline(suiteResults, baseline)
+    speed = suiteResults["calibrationSeconds"] / baseline.get("calibrationSeconds", suiteResults["calibrationSeconds"])
+    for name in regressions:
+        print(f"Regression: {name} {suiteResults['timings'][name] * 1e3:.3f} ms, "
+              f"baseline {baseline['timings'][name] * 1e3:.3f} ms ({baseline['timings'][name] * speed * 1e3:.3f} ms "
+              f"on this machine)")
+    for name in failedChecks:
+        print(f"Output changed: {name}")
+    if failedChecks:
+        sys.exit(1)
+    print(f"{len(baseline['checks'])} checks match the baseline, {len(regressions)} timings regressed")
+
+
+if __name__ == '__main__':
+    main()
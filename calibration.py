@@ -0,0 +1,166 @@
+import time
+import numpy as np
+from image import Image
+from framePipeline import openSource
+from guitarFunctions import neckAngle, rotate, isolateNeck, threadScratch
+from fretboardParams import defaultParams, saveProfile
+
+cameraNumber = 0
+sourcePath = None  # a recorded clip or a directory of images to calibrate on instead of the camera
+profileName = "default"  # saved as fretboard_profiles/<profileName>.json, load it with fretboardProfile
+calibrationFrames = 60  # frames the parameters are tried on
+frameStep = 5  # use every frameStep-th frame of the source, consecutive frames are nearly the same
+sweepPasses = 2
+# Candidates within this much of the best stable detection rate count as equally good, the fastest of them wins
+rateTolerance = 0.02
+# A detected box whose width and height are within this many pixels of the median box is a stable detection
+stableTolerance = 10
+
+# Values tried for every parameter, one parameter at a time while the others keep their current best value
+sweepValues = {
+    "angleThreshold": [100, 125, 150, 175, 200],
+    "angleMinLineLength": [20, 30, 50, 80],
+    "angleMaxLineGap": [0, 5, 10, 25],
+    "stringThreshold": [60, 80, 100, 125, 150],
+    "stringMinLineLength": [30, 50, 80, 120],
+    "stringMaxLineGap": [0, 5, 10, 25],
+    "fretThreshold": [60, 80, 100, 125, 150],
+    "fretMinLineLength": [30, 50, 80],
+    "fretMaxLineGap": [0, 5, 10, 25],
+    "horizontalDiffThreshold": [4, 6, 8],
+    "verticalDiffThreshold": [6, 10, 14],
+}
+
+
+def readFrames(source, count=calibrationFrames, step=frameStep):
+    capture, _ = openSource(source)
+    frames = []
+    index = 0
+    while len(frames) < count:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        if index % step == 0:
+            frames.append(frame)
+        index += 1
+    capture.release()
+    return frames
+
+
+class Calibration():
+    # Tries FretboardParams on a fixed set of frames. Frames rotated with the same angle parameters are kept, so a
+    # sweep over the isolateNeck parameters only pays for the rotation once.
+    def __init__(self, frames):
+        self.images = [Image(image=frame) for frame in frames]
+        self.rotations = {}
+        self.scratch = threadScratch()
+
+    def rotated(self, params):
+        # Rotated Images of all frames and the seconds the rotation took on each
+        key = (params.angleThreshold, params.angleMinLineLength, params.angleMaxLineGap)
+        if key not in self.rotations:
+            rotatedImages, times = [], []
+            for image in self.images:
+                start = time.perf_counter()
+                angle = neckAngle(image, scratch=self.scratch, params=params)
+                rotatedImages.append(Image(image=rotate(image.image, -angle)))
+                times.append(time.perf_counter() - start)
+            self.rotations[key] = (rotatedImages, times)
+        return self.rotations[key]
+
+    def boxes(self, params):
+        # Box of every frame (None where it is rejected) and the mean seconds per frame
+        rotatedImages, rotateTimes = self.rotated(params)
+        boxes = []
+        start = time.perf_counter()
+        for rotatedImage in rotatedImages:
+            boxes.append(isolateNeck(rotatedImage, scratch=self.scratch, params=params))
+        frameTime = (time.perf_counter() - start + sum(rotateTimes)) / len(rotatedImages)
+        return boxes, frameTime
+
+    def evaluate(self, params):
+        boxes, frameTime = self.boxes(params)
+        sizes = np.array([(lastV - firstV, lastH - firstH) for firstH, lastH, firstV, lastV in filter(None, boxes)])
+        if len(sizes):
+            stable = np.all(np.abs(sizes - np.median(sizes, axis=0)) <= stableTolerance, axis=1).sum()
+        else:
+            stable = 0
+        return {"detectionRate": len(sizes) / len(boxes), "stableRate": float(stable / len(boxes)),
+                "msPerFrame": frameTime * 1e3}
+
+    def measureSize(self, params):
+        # Fretboard size params centered on the median box found with the size checks switched off, or params
+        # unchanged when nothing is found
+        looseParams = params._replace(sizeTolerance=10**6, minWidth=0, minHeight=0, maxWidth=10**6, maxHeight=10**6)
+        boxes, _ = self.boxes(looseParams)
+        sizes = [(lastV - firstV, lastH - firstH) for firstH, lastH, firstV, lastV in filter(None, boxes)]
+        if not sizes:
+            return params
+
+        width, height = (int(value) for value in np.median(sizes, axis=0))
+        # The crop is the box grown by 15 pixels to the right and by 15 pixels up and down, keep the margins the
+        # default size range has around it
+        cropWidth, cropHeight = width + 15, height + 30
+        return params._replace(expectedWidth=width, expectedHeight=height,
+                               minWidth=cropWidth - 50, maxWidth=cropWidth + 50,
+                               minHeight=cropHeight - 10, maxHeight=cropHeight + 10)
+
+
+def better(result, best):
+    # Higher stable detection rate wins, within rateTolerance the faster one does
+    if result["stableRate"] > best["stableRate"] + rateTolerance:
+        return True
+    return result["stableRate"] >= best["stableRate"] - rateTolerance and result["msPerFrame"] < best["msPerFrame"]
+
+
+def calibrate(frames, params=defaultParams, passes=sweepPasses, printProgress=True):
+    # Sweep the parameters over frames, returns the best FretboardParams with its result and the result of params
+    calibration = Calibration(frames)
+    initial = calibration.evaluate(params)
+
+    best, bestResult = params, initial
+    sized = calibration.measureSize(params)
+    if sized != params:
+        sizedResult = calibration.evaluate(sized)
+        if better(sizedResult, bestResult):
+            best, bestResult = sized, sizedResult
+
+    for sweep in range(passes):
+        changed = False
+        for name, values in sweepValues.items():
+            for value in values:
+                if value == getattr(best, name):
+                    continue
+                candidate = best._replace(**{name: value})
+                result = calibration.evaluate(candidate)
+                if better(result, bestResult):
+                    best, bestResult, changed = candidate, result, True
+        if printProgress:
+            print(f"Pass {sweep + 1}: stable detection rate {bestResult['stableRate'] * 100:.1f}%, "
+                  f"{bestResult['msPerFrame']:.1f} ms per frame")
+        if not changed:
+            break
+
+    return best, bestResult, initial
+
+
+def main():
+    source = cameraNumber if sourcePath is None else sourcePath
+    frames = readFrames(source)
+    if not frames:
+        print("Error: no frames to calibrate on.")
+        exit(1)
+
+    params, result, initial = calibrate(frames)
+    print(f"Default parameters: stable detection rate {initial['stableRate'] * 100:.1f}%, "
+          f"{initial['msPerFrame']:.1f} ms per frame")
+    print(f"Calibrated parameters: stable detection rate {result['stableRate'] * 100:.1f}%, "
+          f"{result['msPerFrame']:.1f} ms per frame")
+
+    saveProfile(profileName, params, {"source": str(source), "frames": len(frames), "result": result,
+                                      "defaultResult": initial})
+    print(f"Saved profile {profileName}")
+
+
+if __name__ == '__main__':
+    main()
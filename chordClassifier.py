@@ -0,0 +1,120 @@
+import numpy as np
+from featureStore import FeatureStore, semitones
+
+# Chord labels follow the dataset: the root in upper case, and an "M" suffix for minor chords
+# (the "am" folder becomes "AM"), so theoretical and learned templates of one chord share a label.
+majorIntervals = (0, 4, 7)
+minorIntervals = (0, 3, 7)
+
+
+def normalizeRows(matrix):
+    # Scale every row to unit length so that a dot product is a cosine similarity, zero rows stay zero
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def theoreticalTemplates():
+    # Binary major and minor triad templates in all 12 transpositions
+    templates, labels = [], []
+    for root in range(12):
+        for intervals, suffix in ((majorIntervals, ""), (minorIntervals, "M")):
+            template = np.zeros(12)
+            template[[(root + interval) % 12 for interval in intervals]] = 1
+            templates.append(template)
+            labels.append(semitones[root] + suffix)
+    return np.array(templates), labels
+
+
+def learnedTemplates(pcps, labels):
+    # Mean PCP (centroid) of every label
+    pcps = np.asarray(pcps, dtype=np.float64)
+    labels = np.asarray(labels)
+    chordLabels = sorted(set(labels.tolist()))
+    return np.array([pcps[labels == label].mean(axis=0) for label in chordLabels]), chordLabels
+
+
+class ChordClassifier():
+    # Nearest template classifier: the score of a chord is the best cosine similarity between a PCP and any of
+    # its templates, so a batch of PCPs is classified with one matrix multiply and one argmax.
+    def __init__(self, templates, labels):
+        templates = np.asarray(templates)
+        if templates.ndim != 2 or templates.shape[1] != 12 or len(templates) != len(labels):
+            raise ValueError("templates must be a (k, 12) matrix with one label per row")
+
+        # Group the templates of one chord next to each other, so scores can be reduced per chord with slices
+        order = sorted(range(len(labels)), key=lambda i: labels[i])
+        sortedLabels = [labels[i] for i in order]
+
+        self.templates = normalizeRows(templates[order])
+        self.templateLabels = sortedLabels
+        self.labels = sorted(set(sortedLabels))
+        self.labelArray = np.array(self.labels)
+        starts = [sortedLabels.index(label) for label in self.labels] + [len(sortedLabels)]
+        self.chordRanges = list(zip(starts[:-1], starts[1:]))
+        # One template per chord means the reduction can be skipped
+        self.singleTemplate = len(self.labels) == len(sortedLabels)
+
+    @classmethod
+    def theoretical(cls):
+        return cls(*theoreticalTemplates())
+
+    @classmethod
+    def fromData(cls, pcps, labels, includeTheoretical=True):
+        templates, templateLabels = learnedTemplates(pcps, labels)
+        if includeTheoretical:
+            theoretical, theoreticalLabels = theoreticalTemplates()
+            templates = np.vstack([templates, theoretical])
+            templateLabels = templateLabels + theoreticalLabels
+        return cls(templates, templateLabels)
+
+    @classmethod
+    def fromFeatureStore(cls, directory, includeTheoretical=True):
+        store = FeatureStore(directory)
+        return cls.fromData(store.pcp, store.labelNames(), includeTheoretical)
+
+    @classmethod
+    def fromCSV(cls, csvFilePath, includeTheoretical=True):
+        data = np.genfromtxt(csvFilePath, delimiter=",", skip_header=1, dtype=None, encoding=None)
+        pcps = np.array([list(row)[:12] for row in data], dtype=np.float64)
+        labels = [row[12] for row in data]
+        return cls.fromData(pcps, labels, includeTheoretical)
+
+    def chordScores(self, pcps, normalize=True):
+        # (number of chords, n) scores. Working on the transposed product keeps every reduction contiguous.
+        pcps = np.atleast_2d(np.asarray(pcps, dtype=np.float32))
+        if normalize:
+            pcps = normalizeRows(pcps)
+
+        templateScores = self.templates @ pcps.T
+        if self.singleTemplate:
+            return templateScores
+        return np.stack([templateScores[start:end].max(axis=0) for start, end in self.chordRanges])
+
+    def bestChords(self, chordScores):
+        # Index of the best chord of every column, the first one on ties like np.argmax
+        best = chordScores.max(axis=0)
+        index = np.zeros(len(best), dtype=np.intp)
+        for chord in range(len(chordScores) - 1, -1, -1):
+            index[chordScores[chord] == best] = chord
+        return index, best
+
+    def scores(self, pcps):
+        # (n, number of chords) cosine scores, a single PCP gives a (number of chords,) vector
+        scores = self.chordScores(pcps).T
+        return scores[0] if np.ndim(pcps) == 1 else scores
+
+    def classify(self, pcps):
+        # Label of the best scoring chord of every PCP. Scaling a PCP does not change its best template,
+        # so the PCPs are not normalized here.
+        index, _ = self.bestChords(self.chordScores(pcps, normalize=False))
+        labels = self.labelArray[index]
+        return labels[0] if np.ndim(pcps) == 1 else labels
+
+    def classifyWithScores(self, pcps):
+        # Labels, best scores and all (n, number of chords) scores
+        chordScores = self.chordScores(pcps)
+        index, best = self.bestChords(chordScores)
+        if np.ndim(pcps) == 1:
+            return self.labelArray[index[0]], best[0], chordScores[:, 0]
+        return self.labelArray[index], best, chordScores.T
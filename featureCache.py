@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import numpy as np
+from audio import pcpConfig
+
+
+class FeatureCache():
+    # On-disk cache of feature vectors (PCPs) keyed by a hash of the source file contents, the augmentation and its
+    # parameters and the PCP configuration. Entries are .npy files; the least recently used ones are removed once
+    # the cache grows past maxBytes. A cache made by another PCP version is emptied when it is opened with
+    # checkVersion. Only one process may do that: open it once with checkVersion before starting workers, and with
+    # checkVersion=False in the workers, so that no worker empties entries another one has just written.
+    def __init__(self, directory, maxBytes=256 * 2**20, config=None, checkVersion=True):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.config = pcpConfig() if config is None else config
+        self.fileDigests = {}
+
+        os.makedirs(directory, exist_ok=True)
+        if checkVersion:
+            self.checkVersion()
+
+    def checkVersion(self):
+        # Empty the cache if it was made with another PCP configuration, returns True if it was emptied
+        versionPath = os.path.join(self.directory, "VERSION")
+        version = json.dumps(self.config, sort_keys=True)
+        try:
+            with open(versionPath) as versionFile:
+                if versionFile.read() == version:
+                    return False
+        except FileNotFoundError:
+            pass
+
+        self.clear()
+        temporaryPath = versionPath + "." + str(os.getpid()) + ".tmp"
+        with open(temporaryPath, "w") as versionFile:
+            versionFile.write(version)
+        os.replace(temporaryPath, versionPath)
+        return True
+
+    def entries(self):
+        # (path, size, last use) of every cached entry
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed by another process in the meantime
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def fileDigest(self, path):
+        # sha256 of the file contents, remembered for as long as the file keeps its size and modification time
+        stat = os.stat(path)
+        signature = (path, stat.st_size, stat.st_mtime_ns)
+        if signature not in self.fileDigests:
+            digest = hashlib.sha256()
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(2**20), b""):
+                    digest.update(chunk)
+            self.fileDigests[signature] = digest.hexdigest()
+        return self.fileDigests[signature]
+
+    def key(self, fileDigest, augmentation, params=None):
+        description = {"file": fileDigest, "augmentation": augmentation, "params": params or {}, "pcp": self.config}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            features = np.load(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+
+        # Mark the entry as recently used for the eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return features
+
+    def put(self, key, features):
+        path = self.path(key)
+
+        # Write to a temporary file first, other processes may read the same entry at the same time
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+        with open(temporaryPath, "wb") as file:
+            np.save(file, np.asarray(features))
+        os.replace(temporaryPath, path)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in maxBytes, returns the number removed
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+
+        for path, size, _ in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        return removed
@@ -0,0 +1,120 @@
+import os
+import csv
+import json
+import numpy as np
+
+semitones = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+
+# Binary version of audioPCP.csv. A store is a directory with
+#   pcp.npy            float32 (n, 12) PCP matrix
+#   labels.npy         uint8   (n,) index into meta.json "labels"
+#   sources.npy        int32   (n,) index into meta.json "sources", -1 if unknown
+#   augmentations.npy  int8    (n,) index into meta.json "augmentations", -1 if unknown
+#   meta.json          the code tables and the number of rows
+# The .npy files are memory-mapped when reading, so opening a store copies nothing.
+
+
+def encode(values, table=None):
+    # Integer codes of values and the table they index, None values get the code -1
+    if table is None:
+        table = sorted(set(value for value in values if value is not None))
+    index = {value: code for code, value in enumerate(table)}
+    return np.array([index[value] if value is not None else -1 for value in values]), list(table)
+
+
+def writeFeatureStore(directory, pcps, labels, sources=None, augmentations=None):
+    pcps = np.asarray(pcps, dtype=np.float32)
+    if pcps.ndim != 2 or pcps.shape[1] != 12:
+        raise ValueError("pcps must be an (n, 12) matrix")
+
+    n = len(pcps)
+    if sources is None:
+        sources = [None] * n
+    if augmentations is None:
+        augmentations = [None] * n
+    if not len(labels) == len(sources) == len(augmentations) == n:
+        raise ValueError("pcps, labels, sources and augmentations must have the same number of rows")
+
+    labelCodes, labelTable = encode(labels)
+    sourceCodes, sourceTable = encode(sources)
+    augmentationCodes, augmentationTable = encode(augmentations)
+    if len(labelTable) > 255:
+        raise ValueError("A feature store holds at most 255 labels")
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "pcp.npy"), pcps)
+    np.save(os.path.join(directory, "labels.npy"), labelCodes.astype(np.uint8))
+    np.save(os.path.join(directory, "sources.npy"), sourceCodes.astype(np.int32))
+    np.save(os.path.join(directory, "augmentations.npy"), augmentationCodes.astype(np.int8))
+
+    meta = {
+        "count": n,
+        "columns": list(semitones),
+        "labels": labelTable,
+        "sources": sourceTable,
+        "augmentations": augmentationTable,
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as metaFile:
+        json.dump(meta, metaFile, indent=1)
+
+
+class FeatureStore():
+
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        mode = "r" if mmap else None
+
+        with open(os.path.join(directory, "meta.json")) as metaFile:
+            meta = json.load(metaFile)
+
+        self.columns = meta["columns"]
+        self.labelTable = meta["labels"]
+        self.sourceTable = meta["sources"]
+        self.augmentationTable = meta["augmentations"]
+
+        self.pcp = np.load(os.path.join(directory, "pcp.npy"), mmap_mode=mode)
+        self.labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode=mode)
+        self.sources = np.load(os.path.join(directory, "sources.npy"), mmap_mode=mode)
+        self.augmentations = np.load(os.path.join(directory, "augmentations.npy"), mmap_mode=mode)
+
+        if len(self.pcp) != meta["count"]:
+            raise ValueError("Feature store " + directory + " is incomplete")
+
+    def __len__(self):
+        return len(self.pcp)
+
+    def labelNames(self, rows=slice(None)):
+        return np.array(self.labelTable)[self.labels[rows]]
+
+    def labelCode(self, label):
+        return self.labelTable.index(label)
+
+    def rows(self, label=None, augmentation=None):
+        # Indices of the rows with the given label and/or augmentation
+        mask = np.ones(len(self), dtype=bool)
+        if label is not None:
+            mask &= self.labels == self.labelCode(label)
+        if augmentation is not None:
+            mask &= self.augmentations == self.augmentationTable.index(augmentation)
+        return np.flatnonzero(mask)
+
+    def toCSV(self, csvFilePath):
+        # Same layout as audioPCP.csv: 12 PCP columns and the chord label
+        with open(csvFilePath, "w", newline="") as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(self.columns + ["ChordLabel"])
+            for pcp, label in zip(self.pcp.tolist(), self.labelNames()):
+                writer.writerow(pcp + [label])
+
+
+def csvToFeatureStore(csvFilePath, directory):
+    # Convert an existing audioPCP.csv, which has no source or augmentation columns
+    with open(csvFilePath, newline="") as csvFile:
+        reader = csv.reader(csvFile)
+        next(reader)
+        rows = list(reader)
+
+    pcps = np.array([row[:12] for row in rows], dtype=np.float64)
+    labels = [row[12] for row in rows]
+    writeFeatureStore(directory, pcps, labels)
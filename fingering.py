@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+from handTracker import fingertipLandmarks
+
+# Fingering of a fingertip that is not over the fretboard
+offBoard = -1
+
+
+def rotationMatrix(imageShape, angle):
+    # The 2x3 matrix rotate() warps a frame of imageShape with, maps frame pixels to rotated pixels
+    height, width = imageShape[:2]
+    return cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+
+
+class FretboardGeometry():
+    # String and fret lines of one detected fretboard, prepared for mapping many points at once.
+    #
+    # Points are taken in the coordinates of the image the hands were detected in. If that is the rotated image the
+    # grid was found in, no transform is needed; for points in the original frame pass the frame shape and the
+    # angle the frame was rotated by (-neckAngle), or any 3x3 homography from point to grid coordinates.
+    #
+    # Strings are numbered from 1 starting at the lowest line in the image (the high E string of a right handed
+    # player facing the camera, flipStrings=True counts from the top). Frets are counted by the fret lines to the
+    # right of the point, the nut being the rightmost line next to the white plate isolateNeck looks for: 0 is
+    # right of every line, 1 between the nut and the first fret line and so on.
+    def __init__(self, strings, frets, box, homography=None, margin=10, flipStrings=False):
+        self.strings = np.sort(np.asarray(strings, dtype=np.float64))
+        self.frets = np.sort(np.asarray(frets, dtype=np.float64))
+        self.box = tuple(float(value) for value in box)
+        self.homography = None if homography is None else np.asarray(homography, dtype=np.float64)
+        self.margin = margin
+        self.flipStrings = flipStrings
+
+        # A point belongs to the string line it is closest to, i.e. the first midpoint below it decides
+        self.stringMidpoints = (self.strings[1:] + self.strings[:-1]) / 2
+
+    @classmethod
+    def fromGrid(cls, grid, imageShape=None, angle=None, margin=10, flipStrings=False):
+        # Geometry of a FretboardGrid, for points in the frame of imageShape that was rotated by angle, or in the
+        # rotated image itself if they are not given
+        homography = None
+        if angle is not None:
+            homography = np.vstack([rotationMatrix(imageShape, angle), [0, 0, 1]])
+        box = (grid.firstH, grid.lastH, grid.firstV, grid.lastV)
+        return cls(grid.strings, grid.frets, box, homography, margin, flipStrings)
+
+    def toGrid(self, points):
+        # (n, 2) x, y points in grid (rotated image) coordinates
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.homography is None:
+            return points
+        return cv2.perspectiveTransform(points[None], self.homography)[0]
+
+    def locate(self, points):
+        # (n, 2) int array of (string, fret) of every x, y point, offBoard for points outside the fretboard
+        points = self.toGrid(points)
+        x, y = points[:, 0], points[:, 1]
+        firstH, lastH, firstV, lastV = self.box
+
+        onBoard = ((y >= firstH - self.margin) & (y <= lastH + self.margin)
+                   & (x >= firstV - self.margin) & (x <= lastV + self.margin))
+        if not len(self.strings) or not len(self.frets):
+            onBoard[:] = False
+
+        string = np.searchsorted(self.stringMidpoints, y)
+        string = string + 1 if self.flipStrings else len(self.strings) - string
+        # Fret lines to the right of the point, the first space (right of all of them) is fret 0
+        fret = len(self.frets) - np.searchsorted(self.frets, x, side="right")
+
+        located = np.stack([string, fret], axis=1)
+        located[~onBoard] = offBoard
+        return located
+
+    def fingering(self, landmarks):
+        # (hands, 5, 2) (string, fret) of the fingertips of (hands, 21, 2 or 3) landmarks in pixels
+        landmarks = np.asarray(landmarks, dtype=np.float64)
+        if not len(landmarks):
+            return np.empty((0, len(fingertipLandmarks), 2), dtype=np.int16)
+        fingertips = landmarks[:, fingertipLandmarks, :2]
+        return self.locate(fingertips.reshape(-1, 2)).reshape(len(landmarks), len(fingertipLandmarks), 2).astype(np.int16)
+
+
+def chordShape(fingering, numStrings=6):
+    # Compact chord feature of a frame: the highest fretted fret on every string (string 1 first), 0 for strings
+    # no fingertip is on. Thumbs are left out, they rest behind the neck
+    shape = np.zeros(numStrings, dtype=np.int8)
+    fingers = np.asarray(fingering).reshape(-1, len(fingertipLandmarks), 2)[:, 1:].reshape(-1, 2)
+    fingers = fingers[(fingers[:, 0] >= 1) & (fingers[:, 0] <= numStrings) & (fingers[:, 1] > 0)]
+    np.maximum.at(shape, fingers[:, 0] - 1, fingers[:, 1])
+    return shape
+
+
+def drawFingering(imageArray, landmarks, fingering, color=(255, 255, 0)):
+    # Write "string/fret" next to every fingertip that is on the fretboard
+    for hand, handFingering in zip(np.asarray(landmarks), fingering):
+        for (x, y), (string, fret) in zip(hand[fingertipLandmarks, :2].astype(int).tolist(), handFingering.tolist()):
+            if string != offBoard:
+                cv2.putText(imageArray, f"{string}/{fret}", (x + 6, y - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return imageArray
@@ -0,0 +1,286 @@
+import os
+import cv2
+import time
+import threading
+import traceback
+import numpy as np
+from collections import deque, namedtuple
+
+imageExtensions = (".jpg", ".jpeg", ".png", ".bmp")
+
+# One processed frame: its capture index and time, the frame itself, what the process function returned for it,
+# and how long that took
+FrameResult = namedtuple("FrameResult", ["index", "timestamp", "frame", "result", "processTime"])
+
+
+class ImageDirectorySource():
+    # Image files of a directory, in sorted order, with the read()/release() interface of cv2.VideoCapture
+    def __init__(self, directory):
+        self.paths = sorted(os.path.join(directory, file) for file in os.listdir(directory)
+                            if file.lower().endswith(imageExtensions))
+        self.position = 0
+
+    def read(self):
+        while self.position < len(self.paths):
+            frame = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def release(self):
+        self.position = len(self.paths)
+
+
+def openSource(source):
+    # A camera number, a video file or a directory of images. Returns the source and whether it is live
+    if isinstance(source, int):
+        return cv2.VideoCapture(source), True
+    if os.path.isdir(source):
+        return ImageDirectorySource(source), False
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    return cv2.VideoCapture(source), False
+
+
+class DropOldestQueue():
+    # Bounded queue between two stages. When it is full, put() either drops the oldest item (live input, the newest
+    # frame matters most) or waits for room (recorded input, every frame matters).
+    def __init__(self, maxSize, dropOldest=True):
+        self.items = deque()
+        self.maxSize = maxSize
+        self.dropOldest = dropOldest
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        with self.condition:
+            while not self.dropOldest and len(self.items) >= self.maxSize and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return False
+            if len(self.items) >= self.maxSize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        # Next item, or None once the queue is closed and empty (or on timeout)
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StageTimer():
+    # Rolling latencies of one pipeline stage, in seconds
+    def __init__(self, historySize=1000):
+        self.times = deque(maxlen=historySize)
+        self.count = 0
+
+    def add(self, seconds):
+        self.times.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.times:
+            return {"count": self.count}
+        times = np.array(self.times) * 1e3
+        return {"count": self.count, "meanMs": float(times.mean()), "p95Ms": float(np.percentile(times, 95)),
+                "maxMs": float(times.max())}
+
+
+class FramePipeline():
+    # Capture -> process -> display pipeline. A capture thread reads frames into a bounded queue, `workers` threads
+    # run process(frame, workerState) on them (OpenCV releases the GIL, so they run in parallel) and the thread that
+    # iterates results() gets the processed frames to display or write.
+    #
+    # initWorker, if given, is called once in every worker thread and its return value is passed to process as
+    # workerState; it is closed when the worker stops if it has a close() method. Use it for per-thread objects that
+    # are not thread safe, like a HandTracker. Capturing only starts once every worker is initialized, so slow setup
+    # (e.g. warming up a model) does not make the first frames wait or get dropped. If initWorker raises in any
+    # worker, start() stops the pipeline and raises the error.
+    def __init__(self, source, process, workers=1, queueSize=2, initWorker=None, dropFrames=None, printErrors=False):
+        self.capture, live = openSource(source)
+        self.process = process
+        self.workers = workers
+        self.initWorker = initWorker
+        self.printErrors = printErrors
+
+        # Live sources drop the oldest frames when processing can not keep up, recorded ones never drop
+        self.dropFrames = live if dropFrames is None else dropFrames
+        self.inputQueue = DropOldestQueue(queueSize, self.dropFrames)
+        self.outputQueue = DropOldestQueue(max(queueSize, workers), self.dropFrames)
+
+        self.timers = {name: StageTimer() for name in ("capture", "process", "display", "endToEnd")}
+        self.errors = 0
+        self.lateFrames = 0  # processed after a newer frame was already shown
+        self.stopEvent = threading.Event()
+        self.threads = []
+        self.runningWorkers = 0
+        self.lock = threading.Lock()
+        self.workersReady = threading.Semaphore(0)
+        self.initErrors = []  # exceptions initWorker raised
+        self.initTime = 0.0  # seconds from start() until every worker was initialized
+        self.startTime = None  # set once capture starts, stays None if start() failed
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        start = time.perf_counter()
+        self.runningWorkers = self.workers
+        self.threads = [threading.Thread(target=self.workerLoop, name=f"worker{i}", daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        for _ in range(self.workers):
+            self.workersReady.acquire()
+        self.initTime = time.perf_counter() - start
+        if self.initErrors:
+            self.stop()
+            raise RuntimeError(f"initWorker failed in {len(self.initErrors)} of {self.workers} workers") \
+                from self.initErrors[0]
+
+        self.startTime = time.perf_counter()
+        captureThread = threading.Thread(target=self.captureLoop, name="capture", daemon=True)
+        self.threads.insert(0, captureThread)
+        captureThread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.inputQueue.close()
+        self.outputQueue.close()
+        for thread in self.threads:
+            thread.join()
+        self.capture.release()
+
+    def captureLoop(self):
+        index = 0
+        while not self.stopEvent.is_set():
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            self.timers["capture"].add(time.perf_counter() - start)
+
+            if not self.inputQueue.put((index, start, frame)):
+                break
+            index += 1
+
+        self.inputQueue.close()
+
+    def workerLoop(self):
+        workerState = None
+        try:
+            try:
+                workerState = self.initWorker() if self.initWorker is not None else None
+            except Exception as error:
+                with self.lock:
+                    self.initErrors.append(error)
+                return
+            finally:
+                # Released even if initWorker fails, so that start() does not wait forever
+                self.workersReady.release()
+
+            while True:
+                item = self.inputQueue.get()
+                if item is None:
+                    break
+                index, timestamp, frame = item
+
+                start = time.perf_counter()
+                try:
+                    result = self.process(frame, workerState)
+                except Exception:
+                    result = None
+                    with self.lock:
+                        self.errors += 1
+                    if self.printErrors:
+                        traceback.print_exc()
+                processTime = time.perf_counter() - start
+                self.timers["process"].add(processTime)
+
+                self.outputQueue.put(FrameResult(index, timestamp, frame, result, processTime))
+        finally:
+            if workerState is not None and hasattr(workerState, "close"):
+                workerState.close()
+
+            # The last worker to finish tells the capture stage to stop and the display stage that no more results
+            # are coming
+            with self.lock:
+                self.runningWorkers -= 1
+                if self.runningWorkers == 0:
+                    self.inputQueue.close()
+                    self.outputQueue.close()
+
+    def results(self):
+        # Processed frames for the display/writer stage. Live sources give the newest frame and skip the ones that
+        # finished late, recorded sources give every frame in capture order.
+        lastIndex = -1
+        pending = {}
+
+        while True:
+            item = self.outputQueue.get()
+            if item is None:
+                break
+
+            if self.dropFrames:
+                if item.index < lastIndex:
+                    self.lateFrames += 1
+                    continue
+                ready = [item]
+            else:
+                pending[item.index] = item
+                ready = []
+                while lastIndex + 1 in pending:
+                    ready.append(pending.pop(lastIndex + 1))
+                    lastIndex += 1
+
+            for item in ready:
+                lastIndex = max(lastIndex, item.index)
+                self.timers["endToEnd"].add(time.perf_counter() - item.timestamp)
+
+                start = time.perf_counter()
+                yield item
+                self.timers["display"].add(time.perf_counter() - start)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.startTime if self.startTime is not None else 0.0
+        displayed = self.timers["endToEnd"].count
+        return {
+            "stages": {name: timer.summary() for name, timer in self.timers.items()},
+            "captured": self.timers["capture"].count,
+            "displayed": displayed,
+            "droppedBeforeProcessing": self.inputQueue.dropped,
+            "droppedAfterProcessing": self.outputQueue.dropped + self.lateFrames,
+            "errors": self.errors,
+            "fps": displayed / elapsed if elapsed > 0 else 0.0,
+            "initMs": self.initTime * 1e3,
+        }
+
+    def printStats(self):
+        stats = self.stats()
+        print(f"Frames: {stats['captured']} captured, {stats['displayed']} displayed, "
+              f"{stats['droppedBeforeProcessing']} + {stats['droppedAfterProcessing']} dropped, "
+              f"{stats['errors']} errors, {stats['fps']:.1f} fps, workers ready after {stats['initMs']:.0f} ms")
+        for name, summary in stats["stages"].items():
+            if "meanMs" in summary:
+                print(f"\t{name}: mean {summary['meanMs']:.1f} ms, p95 {summary['p95Ms']:.1f} ms, "
+                      f"max {summary['maxMs']:.1f} ms")
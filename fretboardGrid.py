@@ -0,0 +1,89 @@
+import numpy as np
+from math import inf
+from collections import namedtuple
+
+# Strings and frets found in a rotated frame: the y of every string line and the x of every fret line (sorted), and
+# the (firstH, lastH, firstV, lastV) box isolateNeck crops
+FretboardGrid = namedtuple("FretboardGrid", ["strings", "frets", "firstH", "lastH", "firstV", "lastV"])
+
+
+def segmentArray(lines):
+    # Hough segments as an (n, 4) array of x1, y1, x2, y2. Accepts the (n, 1, 4) array of cv2.HoughLinesP
+    # (and the (n, 4) one of newer OpenCV versions) or None
+    if lines is None:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.asarray(lines).reshape(-1, 4)
+
+
+def segmentSlopes(lines):
+    # |dy / dx| of every segment that is not vertical. Vertical segments have no slope and are left out
+    segments = segmentArray(lines).astype(np.float64)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    notVertical = dx != 0
+    return np.abs(dy[notVertical] / dx[notVertical])
+
+
+def horizontalPositions(lines, slopeThreshold=10):
+    # y1 and y2 of every segment whose ends differ by less than slopeThreshold pixels in y
+    segments = segmentArray(lines)
+    horizontal = segments[np.abs(segments[:, 3] - segments[:, 1]) < slopeThreshold]
+    return horizontal[:, [1, 3]].ravel()
+
+
+def verticalPositions(lines, slopeThreshold=5):
+    # x1 and x2 of every segment whose ends differ by less than slopeThreshold pixels in x
+    segments = segmentArray(lines)
+    vertical = segments[np.abs(segments[:, 0] - segments[:, 2]) < slopeThreshold]
+    return vertical[:, [0, 2]].ravel()
+
+
+def positionBounds(positions, diffThreshold, skip):
+    # First and last line position of the fretboard, the same as the loops isolateNeck used to run: over the sorted
+    # positions, every position closer than diffThreshold to the one before it is a candidate (the first position
+    # always is). The last candidate is the end; the first non-zero candidate after index `skip` is the start.
+    # Returns (0, inf) when there is nothing to go on.
+    positions = np.sort(np.asarray(positions))
+    if len(positions) < 2:
+        return 0, inf
+
+    # diff[i] is the gap between position i and i - 1 (0 for the first), the last position is never a candidate
+    diffs = np.diff(positions[:-1], prepend=positions[0])
+    candidates = np.flatnonzero(diffs < diffThreshold)
+    if not len(candidates):
+        return 0, inf
+
+    last = positions[candidates[-1]]
+    starts = candidates[candidates > skip]
+    starts = starts[positions[starts] != 0]
+    first = positions[starts[0]] if len(starts) else 0
+    return first, last
+
+
+def clusterPositions(positions, diffThreshold):
+    # Group the sorted positions into runs whose consecutive gaps are below diffThreshold and return the mean of every
+    # run, one value per string or fret line
+    positions = np.sort(np.asarray(positions, dtype=np.float64))
+    if not len(positions):
+        return positions
+
+    breaks = np.flatnonzero(np.diff(positions) >= diffThreshold) + 1
+    starts = np.concatenate(([0], breaks))
+    return np.add.reduceat(positions, starts) / np.diff(np.concatenate((starts, [len(positions)])))
+
+
+def extractGrid(stringLines, fretLines, horizontalSlopeThreshold=10, horizontalDiffThreshold=6,
+                verticalSlopeThreshold=5, verticalDiffThreshold=10):
+    # Grid of the string hough lines (from sobelY) and fret hough lines (from sobelX) of a rotated frame
+    ys = horizontalPositions(stringLines, horizontalSlopeThreshold)
+    xs = verticalPositions(fretLines, verticalSlopeThreshold)
+
+    firstH, lastH = positionBounds(ys, horizontalDiffThreshold, skip=3)
+    firstV, lastV = positionBounds(xs, verticalDiffThreshold, skip=2)
+
+    strings = clusterPositions(ys, horizontalDiffThreshold)
+    frets = clusterPositions(xs, verticalDiffThreshold)
+    strings = strings[(strings >= firstH) & (strings <= lastH)]
+    frets = frets[(frets >= firstV) & (frets <= lastV)]
+
+    return FretboardGrid(strings, frets, firstH, lastH, firstV, lastV)
@@ -0,0 +1,79 @@
+import os
+import json
+from collections import namedtuple
+
+# Directory the calibrated profiles are saved in, one <name>.json per camera/lighting setup
+profileDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fretboard_profiles")
+
+# Thresholds of the fretboard detection. The defaults are the values rotateNeck and isolateNeck were tuned with. They
+# used to reach cv2.HoughLinesP positionally, so the maxLineGap values acted as minLineLength and the gap was 0; the
+# defaults keep those effective values.
+#   angle*:  binarize threshold and hough minLineLength / maxLineGap of the lines the neck angle is measured on
+#   string*: the same for the string (horizontal) lines of isolateNeck, fret*: for the fret (vertical) lines
+#   *SlopeThreshold: how far (in pixels) the two ends of a segment may be apart across the line to count as straight
+#   *DiffThreshold: largest gap between sorted line positions that still belongs to the fretboard
+#   expectedWidth/Height, sizeTolerance: size the box must be close to
+#   min/max Width/Height: size range of the crop (the box grown by 15 pixels up, down and to the right)
+#   bridgeWhitePixels: white pixels the last 20 columns of the crop need for the bridge to count as present
+fretboardParamNames = [
+    "angleThreshold", "angleMinLineLength", "angleMaxLineGap",
+    "stringThreshold", "stringMinLineLength", "stringMaxLineGap",
+    "fretThreshold", "fretMinLineLength", "fretMaxLineGap",
+    "horizontalSlopeThreshold", "horizontalDiffThreshold", "verticalSlopeThreshold", "verticalDiffThreshold",
+    "expectedWidth", "expectedHeight", "sizeTolerance",
+    "minWidth", "minHeight", "maxWidth", "maxHeight",
+    "bridgeWhitePixels",
+]
+FretboardParams = namedtuple("FretboardParams", fretboardParamNames, defaults=[
+    150, 50, 0,
+    100, 50, 0,
+    100, 50, 0,
+    10, 6, 5, 10,
+    600, 100, 50,
+    550, 100, 650, 120,
+    1300,
+])
+
+defaultParams = FretboardParams()
+
+# Parameters measured in pixels, they grow and shrink with the frame (bridgeWhitePixels only with its height, the
+# bridge region is always 20 columns wide)
+pixelParamNames = [
+    "angleMinLineLength", "angleMaxLineGap", "stringMinLineLength", "stringMaxLineGap",
+    "fretMinLineLength", "fretMaxLineGap",
+    "horizontalSlopeThreshold", "horizontalDiffThreshold", "verticalSlopeThreshold", "verticalDiffThreshold",
+    "expectedWidth", "expectedHeight", "sizeTolerance",
+    "minWidth", "minHeight", "maxWidth", "maxHeight",
+    "bridgeWhitePixels",
+]
+
+
+def scaledParams(params, scale):
+    # params for frames resized by scale, the binarize thresholds stay the same
+    return params._replace(**{name: int(round(getattr(params, name) * scale)) for name in pixelParamNames})
+
+
+def profilePath(name, directory=profileDir):
+    return os.path.join(directory, name + ".json")
+
+
+def saveProfile(name, params, calibration=None, directory=profileDir):
+    # Save params under name, with whatever the calibration wants to remember about how they were found
+    os.makedirs(directory, exist_ok=True)
+    profile = {"params": params._asdict(), "calibration": calibration or {}}
+    with open(profilePath(name, directory), "w") as file:
+        json.dump(profile, file, indent=4)
+
+
+def loadProfile(name, directory=profileDir):
+    # FretboardParams of a saved profile. Parameters the profile does not have keep their defaults,
+    # ones this version does not know about are ignored
+    with open(profilePath(name, directory)) as file:
+        profile = json.load(file)
+    return FretboardParams(**{key: value for key, value in profile["params"].items() if key in fretboardParamNames})
+
+
+def listProfiles(directory=profileDir):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.splitext(file)[0] for file in os.listdir(directory) if file.endswith(".json"))
@@ -0,0 +1,159 @@
+import cv2
+from image import Image
+from guitarFunctions import neckAngle, rotate, findFretboardGrid
+from profiler import profiler
+
+
+class FretboardTracker:
+    # Follows the fretboard from frame to frame so the hough based detection does not have to run on every frame.
+    #
+    # A full detection (rotateNeck's angle + isolateNeck over the whole frame) runs on the first frame, every
+    # redetectEvery frames and whenever verification fails. On the other frames the frame is rotated by the last
+    # angle and the last fretboard crop is looked up with template matching inside the last box grown by padding
+    # pixels, on images downscaled by matchScale. Angle and box are smoothed with an exponential moving average so
+    # the crop does not jitter. params are the FretboardParams of the full detection.
+    def __init__(self, redetectEvery=30, padding=30, smoothing=0.5, maxJump=40, matchScale=4, minMatchScore=0.6,
+                 params=None):
+        self.redetectEvery = redetectEvery
+        self.padding = padding
+        # Weight of the new measurement in the moving average, 1 means no smoothing
+        self.smoothing = smoothing
+        # A box that moved further than this many pixels is taken as is instead of being averaged
+        self.maxJump = maxJump
+        self.matchScale = matchScale
+        # Normalized correlation the crop needs to still count as the fretboard
+        self.minMatchScore = minMatchScore
+        self.params = params
+
+        self.angle = None
+        self.box = None
+        self.template = None
+        self.detectedGrid = None
+        self.framesSinceDetection = 0
+
+        self.frames = 0
+        self.fullDetections = 0
+        self.verifications = 0
+        self.lostFrames = 0
+
+    def reset(self):
+        self.angle = None
+        self.box = None
+        self.template = None
+        self.detectedGrid = None
+        self.framesSinceDetection = 0
+
+    def smooth(self, previous, new):
+        if previous is None:
+            return new
+        return previous + self.smoothing * (new - previous)
+
+    def smoothBox(self, box):
+        if self.box is None or max(abs(new - old) for new, old in zip(box, self.box)) > self.maxJump:
+            return tuple(int(value) for value in box)
+        return tuple(int(round(self.smooth(old, new))) for old, new in zip(self.box, box))
+
+    def downscale(self, imageArray):
+        gray = imageArray if imageArray.ndim == 2 else cv2.cvtColor(imageArray, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        size = (max(1, width // self.matchScale), max(1, height // self.matchScale))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def setTemplate(self, rotatedImage):
+        firstH, lastH, firstV, lastV = self.box
+        self.template = self.downscale(rotatedImage.gray[firstH:lastH, firstV:lastV])
+
+    def detect(self, image, debugImages=None):
+        # Full detection over the whole frame
+        self.fullDetections += 1
+        angle = neckAngle(image, params=self.params)
+        rotatedImage = Image(image=rotate(image.image, -angle))
+        grid = findFretboardGrid(rotatedImage, debugImages, params=self.params)
+        if grid is None:
+            return angle, rotatedImage, None, None
+        return angle, rotatedImage, (grid.firstH, grid.lastH, grid.firstV, grid.lastV), grid
+
+    def grid(self):
+        # FretboardGrid of the last full detection moved to the current box, None if there is no fretboard
+        if self.box is None or self.detectedGrid is None:
+            return None
+        grid = self.detectedGrid
+        dy, dx = self.box[0] - grid.firstH, self.box[2] - grid.firstV
+        return grid._replace(strings=grid.strings + dy, frets=grid.frets + dx, firstH=self.box[0],
+                             lastH=self.box[1], firstV=self.box[2], lastV=self.box[3])
+
+    def verify(self, rotatedArray):
+        # Box of the last crop inside the padded last box, or None if it is not found there any more
+        self.verifications += 1
+        with profiler.stage("tracker.verify"):
+            return self.matchTemplate(rotatedArray)
+
+    def matchTemplate(self, rotatedArray):
+        height, width = rotatedArray.shape[:2]
+
+        firstH, lastH, firstV, lastV = self.box
+        top, bottom = max(0, firstH - self.padding), min(height, lastH + self.padding)
+        left, right = max(0, firstV - self.padding), min(width, lastV + self.padding)
+
+        region = self.downscale(rotatedArray[top:bottom, left:right])
+        if region.shape[0] < self.template.shape[0] or region.shape[1] < self.template.shape[1]:
+            return None
+
+        scores = cv2.matchTemplate(region, self.template, cv2.TM_CCOEFF_NORMED)
+        _, bestScore, _, (x, y) = cv2.minMaxLoc(scores)
+        if bestScore < self.minMatchScore:
+            return None
+
+        top += y * self.matchScale
+        left += x * self.matchScale
+        return top, top + lastH - firstH, left, left + lastV - firstV
+
+    def update(self, image, debugImages=None):
+        # Returns the rotated Image and the (firstH, lastH, firstV, lastV) box in it, or None if there is no fretboard
+        self.frames += 1
+
+        # The last box found by template matching in the frame rotated by the last angle, verified at most once
+        rotatedArray, trackedBox, verified = None, None, False
+        # Re-detections are due every redetectEvery frames since the last successful one
+        if self.box is not None and (self.framesSinceDetection == 0 or self.framesSinceDetection % self.redetectEvery):
+            rotatedArray = rotate(image.image, -self.angle)
+            trackedBox, verified = self.verify(rotatedArray), True
+            if trackedBox is not None:
+                self.framesSinceDetection += 1
+                self.box = self.smoothBox(trackedBox)
+                return Image(image=rotatedArray), self.box
+
+        angle, rotatedImage, box, grid = self.detect(image, debugImages)
+
+        if box is None:
+            if self.box is not None and not verified:
+                # A scheduled re-detection that failed while the last crop can still be found keeps tracking until the
+                # next scheduled one
+                rotatedArray = rotate(image.image, -self.angle)
+                trackedBox = self.verify(rotatedArray)
+            if trackedBox is not None:
+                self.framesSinceDetection += 1
+                self.box = self.smoothBox(trackedBox)
+                return Image(image=rotatedArray), self.box
+
+            self.lostFrames += 1
+            profiler.count("tracker.lost")
+            self.reset()
+            return rotatedImage, None
+
+        self.angle = self.smooth(self.angle, angle)
+        if self.angle != angle:
+            # The box was found in the frame rotated by the new angle, rotate again by the smoothed one so that the
+            # returned image and later frames agree
+            rotatedImage = Image(image=rotate(image.image, -self.angle))
+
+        self.framesSinceDetection = 0
+        self.box = self.smoothBox(box)
+        self.detectedGrid = grid
+        self.setTemplate(rotatedImage)
+        return rotatedImage, self.box
+
+    def stats(self):
+        return {"frames": self.frames, "fullDetections": self.fullDetections, "verifications": self.verifications,
+                "lostFrames": self.lostFrames,
+                "fullDetectionRate": self.fullDetections / self.frames if self.frames else 0.0}
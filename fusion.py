@@ -0,0 +1,388 @@
+import os
+import cv2
+import time
+import threading
+import numpy as np
+from math import inf
+from collections import Counter, deque, namedtuple
+from image import Image
+from audioStream import StreamingPCP
+from audioFile import AudioFileSource
+from chordClassifier import ChordClassifier, normalizeRows
+from framePipeline import FramePipeline, DropOldestQueue, StageTimer, imageExtensions
+from guitarFunctions import rotateNeck, isolateNeck
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+# Recorded inputs used when main() is run, a camera number works as videoSource too
+audioSource = os.path.join(baseDir, "chord_audio_files", "a", "a1.wav")
+videoSource = os.path.join(baseDir, "chords", "A")
+csvFilePath = os.path.join(baseDir, "audioPCP.csv")
+imageDir = os.path.join(baseDir, "chords")
+videoFPS = 30  # frame rate of a recorded video source (a folder of images has none)
+framesAreCrops = True  # the video frames are fretboard crops already (like chords/), so isolateNeck is skipped
+realTime = True  # play recorded inputs at their real speed, False runs them as fast as possible
+
+audioBlockSize = 512
+# Only analyze the frame after every strum (see onsets.py) instead of one frame every hop. Audio results then come
+# once per strum, so decisions in between are made from the video alone
+audioOnsets = False
+maxSkew = 0.25  # seconds an audio and a video result may be apart to be fused
+audioWeight = 0.6
+videoWeight = 0.4
+# Softmax temperature that turns the cosine scores of a modality into probabilities
+temperature = 0.05
+# The audio label (chordClassifier.py: root in upper case, "M" suffix for minor) every chords/ folder is scored as, so
+# that both modalities vote on the same chords. The folders are only named by their root. There is no B major in the
+# audio dataset, the chords/B crops are taken as B minor
+videoLabels = {"A": "A", "B": "BM", "C": "C", "D": "D", "E": "E", "F": "F", "G": "G"}
+
+# Output of one modality at one point in time: its media timestamp (seconds from the start), when its input was
+# captured (time.perf_counter), and the probability of every label
+ModalityResult = namedtuple("ModalityResult", ["timestamp", "arrival", "labels", "probabilities"])
+# A joint decision: the fused chord and confidence, (chord, confidence) of every modality that took part (None if it
+# was missing or too far apart) and the seconds from capturing the newest input to the decision
+FusedDecision = namedtuple("FusedDecision", ["timestamp", "chord", "confidence", "audio", "video", "latency"])
+
+
+def softmax(scores, temperature=temperature):
+    scores = np.asarray(scores, dtype=np.float64) / temperature
+    scores = np.exp(scores - scores.max())
+    return scores / scores.sum()
+
+
+def cropFeatures(crops, size=(96, 24)):
+    # Every crop downscaled to a small grayscale image, flattened, with zero mean and unit length
+    features = []
+    for crop in crops:
+        gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+        features.append(small - small.mean())
+    return normalizeRows(np.array(features))
+
+
+class CropClassifier():
+    # Nearest template classifier for fretboard crops: every chord's template is the mean cropFeatures of its crops
+    # in chords/, so a score is a cosine similarity
+    def __init__(self, templates, labels, size=(96, 24)):
+        self.templates = normalizeRows(templates)
+        self.labels = list(labels)
+        self.size = size
+
+    @classmethod
+    def fromDirectory(cls, directory=imageDir, size=(96, 24), perChord=200, labelMap=videoLabels):
+        # labelMap maps the upper case folder name to the label, folders it does not have keep their name
+        templates, labels = [], []
+        for chordLabel in sorted(os.listdir(directory)):
+            chordDir = os.path.join(directory, chordLabel)
+            if not os.path.isdir(chordDir):
+                continue
+            files = sorted(file for file in os.listdir(chordDir) if file.lower().endswith(imageExtensions))
+            crops = [cv2.imread(os.path.join(chordDir, file)) for file in files[:perChord]]
+            crops = [crop for crop in crops if crop is not None]
+            if crops:
+                templates.append(cropFeatures(crops, size).mean(axis=0))
+                labels.append(labelMap.get(chordLabel.upper(), chordLabel.upper()))
+        return cls(np.array(templates), labels, size)
+
+    def scores(self, crop):
+        # (number of labels,) cosine scores of one crop
+        return (self.templates @ cropFeatures([crop], self.size).T)[:, 0]
+
+
+class TimestampBuffer():
+    # The last maxSize results (all of them for None) of one modality in timestamp order, safe to use from several
+    # threads
+    def __init__(self, maxSize=64):
+        self.results = deque(maxlen=maxSize)
+        self.lock = threading.Lock()
+
+    def put(self, result):
+        with self.lock:
+            self.results.append(result)
+
+    def latest(self):
+        with self.lock:
+            return self.results[-1] if self.results else None
+
+    def timestamps(self, after=-inf):
+        with self.lock:
+            return [result.timestamp for result in self.results if result.timestamp > after]
+
+    def discardBefore(self, timestamp):
+        with self.lock:
+            while self.results and self.results[0].timestamp < timestamp:
+                self.results.popleft()
+
+    def nearest(self, timestamp, maxSkew=maxSkew):
+        # The result closest to timestamp, or None if there is none within maxSkew seconds
+        with self.lock:
+            if not self.results:
+                return None
+            best = min(self.results, key=lambda result: abs(result.timestamp - timestamp))
+        return best if abs(best.timestamp - timestamp) <= maxSkew else None
+
+
+class FusionEngine():
+    # Runs the audio and the video modality on their own threads and fuses their results into chord decisions.
+    #
+    # The audio thread turns blocks into PCPs with StreamingPCP and scores them with a ChordClassifier, the video
+    # thread runs a FramePipeline that isolates the fretboard and scores the crop with a CropClassifier. Both put
+    # their results, stamped with media time, into a TimestampBuffer. The fusion thread wakes up on every new result
+    # and combines the results of both modalities nearest to it in time (a weighted mean of their probabilities over
+    # the union of their labels). A modality that is late, missing or finished is left out, so decisions never
+    # wait for it. Live inputs decide at the newest result. Recorded inputs run as fast as possible (realTime=False)
+    # are decided on media time instead: every result timestamp of either modality is decided at, in order, once
+    # every modality still running has processed maxSkew past it, so its nearest results are final whichever
+    # modality runs ahead. Results are then kept until no later decision can use them.
+    #
+    # audioSource is a sound file or an iterable of mono blocks (e.g. fed by an audio callback, pass sampleRate),
+    # videoSource anything openSource accepts. Either may be None.
+    def __init__(self, audioSource=None, videoSource=None, audioClassifier=None, videoClassifier=None,
+                 sampleRate=44100, realTime=realTime, videoFPS=videoFPS, framesAreCrops=framesAreCrops,
+                 frameSize=8192, hopSize=2048, blockSize=audioBlockSize, maxSkew=maxSkew,
+                 audioWeight=audioWeight, videoWeight=videoWeight, temperature=temperature, audioOnsets=audioOnsets):
+        self.audioSource = audioSource
+        self.videoSource = videoSource
+        self.audioClassifier = audioClassifier
+        self.videoClassifier = videoClassifier
+        self.sampleRate = sampleRate
+        self.realTime = realTime
+        self.videoFPS = videoFPS
+        self.framesAreCrops = framesAreCrops
+        self.frameSize = frameSize
+        self.hopSize = hopSize
+        self.blockSize = blockSize
+        self.audioOnsets = audioOnsets
+        self.maxSkew = maxSkew
+        self.weights = {"audio": audioWeight, "video": videoWeight}
+        self.temperature = temperature
+
+        bufferSize = 64 if realTime else None
+        self.buffers = {"audio": TimestampBuffer(bufferSize), "video": TimestampBuffer(bufferSize)}
+        self.running = {name: source is not None for name, source in (("audio", audioSource),
+                                                                      ("video", videoSource))}
+        # Media time every modality has processed up to, results or not
+        self.progress = {"audio": -inf, "video": -inf}
+        self.condition = threading.Condition()
+        self.decisionQueue = DropOldestQueue(64, dropOldest=realTime)
+        self.stopEvent = threading.Event()
+        self.threads = []
+
+        self.latency = StageTimer()
+        self.modalityCounts = Counter()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if self.running["audio"] and self.audioClassifier is None:
+            self.audioClassifier = ChordClassifier.fromCSV(csvFilePath)
+        if self.running["video"] and self.videoClassifier is None:
+            self.videoClassifier = CropClassifier.fromDirectory()
+        if self.running["audio"] and self.running["video"]:
+            # A video label the audio classifier does not know would never be confirmed by audio, see videoLabels
+            unknown = sorted(set(self.videoClassifier.labels) - set(self.audioClassifier.labels))
+            if unknown:
+                raise ValueError(f"video labels {unknown} are not audio classifier labels, map them in videoLabels")
+
+        self.startTime = time.perf_counter()
+        self.threads = [threading.Thread(target=self.fusionLoop, name="fusion", daemon=True)]
+        if self.running["audio"]:
+            self.threads.append(threading.Thread(target=self.audioLoop, name="audio", daemon=True))
+        if self.running["video"]:
+            self.threads.append(threading.Thread(target=self.videoLoop, name="video", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        with self.condition:
+            self.condition.notify_all()
+        self.decisionQueue.close()
+        for thread in self.threads:
+            thread.join()
+
+    def wait(self, mediaTime):
+        # Hold a recorded input back until its media time has come
+        if self.realTime:
+            delay = self.startTime + mediaTime - time.perf_counter()
+            if delay > 0:
+                self.stopEvent.wait(delay)
+
+    def publish(self, name, timestamp, arrival, labels, scores):
+        result = ModalityResult(timestamp, arrival, labels, softmax(scores, self.temperature))
+        self.buffers[name].put(result)
+        with self.condition:
+            self.condition.notify_all()
+
+    def advance(self, name, mediaTime):
+        with self.condition:
+            self.progress[name] = mediaTime
+            self.condition.notify_all()
+
+    def finish(self, name):
+        with self.condition:
+            self.running[name] = False
+            self.condition.notify_all()
+
+    def audioBlocks(self):
+        if isinstance(self.audioSource, str):
+            source = AudioFileSource(self.audioSource, self.blockSize)
+            self.sampleRate = source.sampleRate
+            return source.blocks()
+        return self.audioSource
+
+    def audioLoop(self):
+        try:
+            # Opening the source sets the sample rate of a sound file
+            blocks = self.audioBlocks()
+            stream = StreamingPCP(self.sampleRate, self.frameSize, self.hopSize, onsets=self.audioOnsets)
+            stream.warmUp()
+            labels = self.audioClassifier.labels
+            samples = 0
+            for block in blocks:
+                if self.stopEvent.is_set():
+                    break
+                samples += len(block)
+                self.wait(samples / self.sampleRate)
+                arrival = time.perf_counter()
+                for timestamp, pcp in stream.process(block):
+                    self.publish("audio", timestamp, arrival, labels, self.audioClassifier.scores(pcp))
+                self.advance("audio", samples / self.sampleRate)
+        finally:
+            self.finish("audio")
+
+    def processFrame(self, frame, workerState=None):
+        # Scores of the fretboard in one frame, None if it is not found
+        if self.framesAreCrops:
+            crop = frame
+        else:
+            rotatedImage = rotateNeck(Image(image=frame))
+            box = isolateNeck(rotatedImage) if rotatedImage else None
+            if box is None:
+                return None
+            firstH, lastH, firstV, lastV = box
+            crop = rotatedImage.image[firstH - 15:lastH + 15, firstV - 15:lastV + 15]
+        return self.videoClassifier.scores(crop)
+
+    def videoLoop(self):
+        try:
+            pipeline = FramePipeline(self.videoSource, self.processFrame)
+            live = pipeline.dropFrames
+            with pipeline:
+                for item in pipeline.results():
+                    if self.stopEvent.is_set():
+                        break
+                    timestamp = item.timestamp - self.startTime if live else item.index / self.videoFPS
+                    if not live:
+                        self.wait(timestamp)
+                    if item.result is not None:
+                        arrival = item.timestamp if live else time.perf_counter()
+                        self.publish("video", timestamp, arrival, self.videoClassifier.labels, item.result)
+                    self.advance("video", timestamp)
+        finally:
+            self.finish("video")
+
+    def decisionTimes(self, lastTimestamp=None):
+        # Media times to decide at next in order, empty if there is nothing new
+        if lastTimestamp is None:
+            lastTimestamp = -inf
+        if self.realTime:
+            latest = [result.timestamp for result in (buffer.latest() for buffer in self.buffers.values())
+                      if result is not None]
+            return [max(latest)] if latest and max(latest) > lastTimestamp else []
+
+        # Offline, up to where the nearest results of every running modality can no longer change
+        with self.condition:
+            horizon = min((self.progress[name] - self.maxSkew for name, running in self.running.items() if running),
+                          default=inf)
+        timestamps = set()
+        for buffer in self.buffers.values():
+            timestamps.update(timestamp for timestamp in buffer.timestamps(lastTimestamp) if timestamp <= horizon)
+        return sorted(timestamps)
+
+    def fuse(self, timestamp):
+        results = {name: buffer.nearest(timestamp, self.maxSkew) for name, buffer in self.buffers.items()}
+        results = {name: result for name, result in results.items() if result is not None}
+        if not results:
+            return None
+
+        labels = sorted(set(label for result in results.values() for label in result.labels))
+        index = {label: i for i, label in enumerate(labels)}
+        probabilities = np.zeros(len(labels))
+        modalities = {}
+        for name, result in results.items():
+            positions = [index[label] for label in result.labels]
+            probabilities[positions] += self.weights[name] * result.probabilities
+            best = int(np.argmax(result.probabilities))
+            modalities[name] = (result.labels[best], float(result.probabilities[best]))
+        probabilities /= sum(self.weights[name] for name in results)
+
+        best = int(np.argmax(probabilities))
+        latency = time.perf_counter() - max(result.arrival for result in results.values())
+        return FusedDecision(timestamp, labels[best], float(probabilities[best]), modalities.get("audio"),
+                             modalities.get("video"), latency)
+
+    def fusionLoop(self):
+        lastTimestamp = None
+        while not self.stopEvent.is_set():
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopEvent.is_set() or not any(self.running.values())
+                                        or self.hasNewResult(lastTimestamp), timeout=0.1)
+                finished = not any(self.running.values())
+
+            timestamps = self.decisionTimes(lastTimestamp)
+            if not timestamps and finished:
+                break
+            for timestamp in timestamps:
+                decision = self.fuse(timestamp)
+                lastTimestamp = timestamp
+                if decision is not None:
+                    self.latency.add(decision.latency)
+                    self.modalityCounts["+".join(name for name in ("audio", "video")
+                                                 if getattr(decision, name) is not None)] += 1
+                    self.decisionQueue.put(decision)
+            if not self.realTime and lastTimestamp is not None:
+                # Later decisions are at or after lastTimestamp, older results can no longer be nearest to them
+                for buffer in self.buffers.values():
+                    buffer.discardBefore(lastTimestamp - self.maxSkew)
+
+        self.decisionQueue.close()
+
+    def hasNewResult(self, lastTimestamp):
+        return bool(self.decisionTimes(lastTimestamp))
+
+    def decisions(self):
+        # Fused decisions as they are made, ends when both inputs are done
+        while True:
+            decision = self.decisionQueue.get()
+            if decision is None:
+                break
+            yield decision
+
+    def stats(self):
+        return {"decisions": self.latency.count, "modalities": dict(self.modalityCounts),
+                "latency": self.latency.summary(), "droppedDecisions": self.decisionQueue.dropped}
+
+
+def main():
+    with FusionEngine(audioSource, videoSource) as engine:
+        for decision in engine.decisions():
+            audio = f"{decision.audio[0]} {decision.audio[1]:.2f}" if decision.audio else "-"
+            video = f"{decision.video[0]} {decision.video[1]:.2f}" if decision.video else "-"
+            print(f"{decision.timestamp:6.2f} s: {decision.chord} ({decision.confidence:.2f}), "
+                  f"audio {audio}, video {video}, latency {decision.latency * 1e3:.1f} ms")
+
+    stats = engine.stats()
+    print(f"{stats['decisions']} decisions, by modality {stats['modalities']}")
+    if "meanMs" in stats["latency"]:
+        print(f"Latency: mean {stats['latency']['meanMs']:.1f} ms, p95 {stats['latency']['p95Ms']:.1f} ms, "
+              f"max {stats['latency']['maxMs']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,53 @@
 import os
-import pandas as pd
-import librosa
-import matplotlib.pyplot as plt
+import json
+import zlib
 import soundfile as sf  # for reading and writing audio files
 import numpy as np  # for adding noise
-from audio import Audio
-from pedalboard import Reverb
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from audio import Audio, pcpConfig
+from featureCache import FeatureCache
+from featureStore import writeFeatureStore
+from onsets import onsetWindow
 
 
 sampleRate = 44100
 plotPCP = False
 saveAugmented = False
 augmentData = True
+workers = os.cpu_count()  # processes used to build the dataset, 1 runs everything in this process
+seed = 0  # base seed of the noise augmentation, every file derives its own seed from it
+# PCPs are computed over this many samples from the strum on (see onsets.py), None uses the whole clip
+onsetWindowSize = 2**15
+
+# Augmentation parameters
+reverbRoomSize = 0.75
+noiseFactor = 0.3
+stretchRate = 0.7
 
 # Directory containing the .wav files
 dataDir = "multimodal-guitar-chord-recog/chord_audio_files"
+# Per file results of an interrupted build are kept here and reused on the next run
+checkpointDir = "multimodal-guitar-chord-recog/audioPCP_checkpoints"
+# PCPs of every file and augmentation, keyed by file contents and parameters, shared by all builds
+featureCacheDir = "multimodal-guitar-chord-recog/audioPCP_cache"
+featureCacheMaxBytes = 256 * 2**20
+csvFilePath = "multimodal-guitar-chord-recog/audioPCP.csv"
+# Memory-mappable binary copy of the dataset, see featureStore.py
+featureStoreDir = "multimodal-guitar-chord-recog/audioPCP_store"
+outputFormat = "both"  # "csv", "store" or "both"
+
+# Define column names for the DataFrame (12 pitch class profiles + 1 label)
+columnNames = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'] + ['ChordLabel']
 
-# Function to apply reverb effect to an audio file
-def applyReverb(audio, sampleRate, audioPath):
-    reverb = Reverb(room_size=0.75)
+# Function to apply reverb effect to an audio file, reverb reuses an existing Reverb instead of creating one
+def applyReverb(audio, sampleRate, audioPath, roomSize=0.75, reverb=None):
+    if reverb is None:
+        # pandas, librosa, matplotlib and pedalboard are imported where they are used, importing this module for
+        # its settings and helpers stays fast
+        from pedalboard import Reverb
+        reverb = Reverb(room_size=roomSize)
+    else:
+        reverb.room_size = roomSize
     reverbAudio = reverb(audio, sampleRate)
 
     if saveAugmented:
@@ -33,8 +62,10 @@ def applyReverb(audio, sampleRate, audioPath):
 
 
 # Function to add noise to an audio file
-def addNoise(audio, sampleRate, audioPath, noiseFactor=0.05):
-    noise = np.random.normal(0, audio.std(), audio.size)
+def addNoise(audio, sampleRate, audioPath, noiseFactor=0.05, seed=None):
+    # The same seed always gives the same noise, None draws fresh noise on every call
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, audio.std(), audio.size)
     noisyAudio = audio + noise * noiseFactor
 
     if saveAugmented:
@@ -49,6 +80,7 @@ def addNoise(audio, sampleRate, audioPath, noiseFactor=0.05):
 
 
 def timeStretch(audio, sampleRate, audioPath, stretchRate=0.7):
+    import librosa
     stretchedAudio = librosa.effects.time_stretch(audio, rate=stretchRate)
 
     if saveAugmented:
@@ -62,96 +94,296 @@ def timeStretch(audio, sampleRate, audioPath, stretchRate=0.7):
     return Audio(audio=stretchedAudio, sampleRate=sampleRate)
 
 
+def strumSegment(samples):
+    # The onsetWindowSize samples from the strum on, zero padded when the clip is shorter
+    if onsetWindowSize is None:
+        return samples
+    return onsetWindow(samples, onsetWindowSize)
+
+
+def fileSeed(chordLabel, file, baseSeed):
+    # Seed that only depends on the file and the base seed, not on which worker or in which order it runs
+    return zlib.crc32((chordLabel + "/" + file).encode()) ^ baseSeed
+
+
+def listWavFiles(directory):
+    # (chord label, file name) of every .wav file, sorted so that the dataset rows always come out in the same order
+    wavFiles = []
+    for chordLabel in sorted(os.listdir(directory)):
+        chordDir = os.path.join(directory, chordLabel)
+        if os.path.isdir(chordDir):
+            for file in sorted(os.listdir(chordDir)):
+                if file.endswith(".wav"):
+                    wavFiles.append((chordLabel, file))
+    return wavFiles
+
+
+# Function to read one .wav file and extract the features of it and its augmentations
+def processWavFile(directory, chordLabel, file, noiseSeed=None, cache=None):
+
+    # Initialize chord vectors for normal, reverb, and noise versions
+    chordVectors = []
+
+    filePath = os.path.join(directory, chordLabel, file)
+
+    if plotPCP or saveAugmented:
+        # Plots and saved augmentations need the audio itself, not only the cached PCP
+        cache = None
+    fileDigest = cache.fileDigest(filePath) if cache is not None else None
+
+    # (name, parameters, function making the Audio object) of the normal audio and every augmentation
+    versions = [("normal", {}, lambda audio, sampleRate: Audio(audio=audio, sampleRate=sampleRate))]
+    if augmentData:
+        versions += [
+            ("reverb", {"room_size": reverbRoomSize},
+             lambda audio, sampleRate: applyReverb(audio, sampleRate, filePath, roomSize=reverbRoomSize)),
+            ("noise", {"noiseFactor": noiseFactor, "seed": noiseSeed},
+             lambda audio, sampleRate: addNoise(audio, sampleRate, filePath, noiseFactor=noiseFactor, seed=noiseSeed)),
+            ("stretch", {"stretchRate": stretchRate},
+             lambda audio, sampleRate: timeStretch(audio, sampleRate, filePath, stretchRate=stretchRate)),
+        ]
+
+    # The file is only read if at least one version is not cached
+    audio = None
+    audios = []
+
+    for name, params, makeAudio in versions:
+        # Noise without a seed is different every time, there is nothing to cache
+        key = None
+        if cache is not None and params.get("seed", 0) is not None:
+            key = cache.key(fileDigest, name, params)
+            profile = cache.get(key)
+            if profile is not None:
+                chordVectors.append(profile.tolist())
+                continue
+
+        if audio is None:
+            audio, sampleRate = sf.read(filePath)
+
+        versionAudio = makeAudio(audio, sampleRate)
+        versionAudio = Audio(audio=strumSegment(versionAudio.samples()), sampleRate=sampleRate)
+        profile = versionAudio.getPCP()  # pitch class profile
+        audios.append(versionAudio)
+        chordVectors.append(profile)
+
+        if key is not None:
+            cache.put(key, profile)
+
+    if plotPCP:
+        import matplotlib.pyplot as plt
+        if augmentData:
+            normalAudio, reverbAudio, noisyAudio, stretchedAudio = audios
+
+            # Create subplots
+            fig, axes = plt.subplots(2, 2, figsize=(10, 8))
+            fig.suptitle('PCP Comparison for chord ' + chordLabel.upper(), fontsize=16)
+            normalAudio.plotPCP('Normal PCP', ax=axes[0, 0])
+            reverbAudio.plotPCP('Reverb PCP', ax=axes[0, 1])
+            noisyAudio.plotPCP('Noisy PCP', ax=axes[1, 0])
+            stretchedAudio.plotPCP('Stretched PCP', ax=axes[1, 1])
+
+            plt.tight_layout()
+            plt.subplots_adjust(top=0.85)
+
+            plt.show()
+        else:
+            normalAudio, = audios
+
+            fig, axes = plt.subplots(1, 1, figsize=(5, 4))
+            fig.suptitle('PCP Comparison', fontsize=16)
+            normalAudio.plotPCP('Normal PCP', ax=axes)
+            plt.tight_layout()
+            plt.subplots_adjust(top=0.5)
+
+            plt.show()
+
+    # Add chord label to each version
+    for chordVector in chordVectors:
+        chordVector.append(chordLabel.upper())  # Append chord label
+
+    return chordVectors
+
+
 # Function to read .wav files and extract features
 def processWavFiles(directory):
 
     chordData = []  # List to store the processed data
 
-    # Iterate through subdirectories (chord labels)
-    for chordLabel in os.listdir(directory):
-        print("Processing chord " + chordLabel)
-        chordDir = os.path.join(directory, chordLabel)
-
-        # Check if the item in the directory is a subdirectory (chord label)
-        if os.path.isdir(chordDir):
+    for chordLabel, file in listWavFiles(directory):
+        print("Processing " + chordLabel + "/" + file)
+        chordData += processWavFile(directory, chordLabel, file, fileSeed(chordLabel, file, seed))
 
-            # Iterate through .wav files in the subdirectory
-            for file in os.listdir(chordDir):
-                if file.endswith(".wav"):
-                    print("\t" + file)
-
-                    # Initialize chord vectors for normal, reverb, and noise versions
-                    chordVectors = []
-
-                    # Process the normal audio file
-                    filePath = os.path.join(chordDir, file)
-                    audio, sampleRate = sf.read(filePath)
-
-                    normalAudio = Audio(audio=audio, sampleRate=sampleRate)
-                    normalProfile = normalAudio.getPCP()
-                    chordVectors.append(normalProfile)  # Append pitch class profiles
-
-                    if augmentData:
-                        # Apply reverb effect to the audio file
-                        reverbAudio = applyReverb(audio, sampleRate, filePath)
-                        reverbProfile = reverbAudio.getPCP()
-                        chordVectors.append(reverbProfile)
-
-                        # Add noise to the audio file
-                        noisyAudio = addNoise(audio, sampleRate, filePath, noiseFactor=0.3)
-                        noisyProfile = noisyAudio.getPCP()
-                        chordVectors.append(noisyProfile)
-                        
-                        # Stretch the audio file
-                        stretchedAudio = timeStretch(audio, sampleRate, filePath)
-                        stretchedProfile = stretchedAudio.getPCP()
-                        chordVectors.append(stretchedProfile)
-
-                        if plotPCP:
-                            # Create subplots
-                            fig, axes = plt.subplots(2, 2, figsize=(10, 8))
-                            fig.suptitle('PCP Comparison for chord ' + chordLabel.upper(), fontsize=16)
-                            normalAudio.plotPCP('Normal PCP', ax=axes[0, 0])
-                            reverbAudio.plotPCP('Reverb PCP', ax=axes[0, 1])
-                            noisyAudio.plotPCP('Noisy PCP', ax=axes[1, 0])
-                            stretchedAudio.plotPCP('Stretched PCP', ax=axes[1, 1])
-
-                            plt.tight_layout()
-                            plt.subplots_adjust(top=0.85)
-
-                            plt.show()
-                    else:
-                        if plotPCP:
-                            fig, axes = plt.subplots(1, 1, figsize=(5, 4))
-                            fig.suptitle('PCP Comparison', fontsize=16)
-                            normalAudio.plotPCP('Normal PCP', ax=axes)
-                            plt.tight_layout()
-                            plt.subplots_adjust(top=0.5)
-
-                            plt.show()
-
-                    # Add chord label to each version
-                    for chordVector in chordVectors:
-                        chordVector.append(chordLabel.upper())  # Append chord label
-                        chordData.append(chordVector)
-                    
     return chordData
 
 
-# Process .wav files and create a dataset
-dataset = processWavFiles(dataDir)
+def checkpointPath(checkpointDirectory, chordLabel, file):
+    return os.path.join(checkpointDirectory, chordLabel, file + ".json")
+
+
+def checkpointSettings(filePath, noiseSeed):
+    # Everything that changes the rows of a file, a checkpoint made with other settings or of an
+    # older version of the file is recomputed
+    stat = os.stat(filePath)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "augmentData": augmentData,
+        "augmentations": [reverbRoomSize, noiseFactor, stretchRate],
+        "seed": noiseSeed,
+        "pcp": pcpConfig(),
+        "onsetWindow": onsetWindowSize,
+    }
+
+
+def loadCheckpoint(checkpointDirectory, directory, chordLabel, file, noiseSeed):
+    path = checkpointPath(checkpointDirectory, chordLabel, file)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path) as checkpointFile:
+            checkpoint = json.load(checkpointFile)
+    except ValueError:
+        # Half written or corrupted checkpoint, compute the file again
+        return None
+
+    if checkpoint.get("settings") != checkpointSettings(os.path.join(directory, chordLabel, file), noiseSeed):
+        return None
+    return checkpoint["rows"]
+
+
+def saveCheckpoint(checkpointDirectory, directory, chordLabel, file, noiseSeed, rows):
+    path = checkpointPath(checkpointDirectory, chordLabel, file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so that an interrupted run never leaves a partial checkpoint behind
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "w") as checkpointFile:
+        settings = checkpointSettings(os.path.join(directory, chordLabel, file), noiseSeed)
+        json.dump({"settings": settings, "rows": rows}, checkpointFile)
+    os.replace(temporaryPath, path)
+
+
+# Feature caches opened by this process, one per directory
+featureCaches = {}
+
+
+def openFeatureCache(cacheDirectory, checkVersion=True):
+    # buildAudioDataset opens the cache (and empties one of another PCP version) before starting the workers, which
+    # open it with checkVersion=False
+    if cacheDirectory is None:
+        return None
+    if cacheDirectory not in featureCaches:
+        config = {**pcpConfig(), "onsetWindow": onsetWindowSize}
+        featureCaches[cacheDirectory] = FeatureCache(cacheDirectory, featureCacheMaxBytes, config, checkVersion)
+    return featureCaches[cacheDirectory]
 
-# Convert the dataset to a pandas DataFrame
-df = pd.DataFrame(dataset)
 
-# Define column names for the DataFrame (12 pitch class profiles + 1 label)
-columnNames = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'] + ['ChordLabel']
+def processTask(task):
+    directory, chordLabel, file, noiseSeed, cacheDirectory = task
+    return processWavFile(directory, chordLabel, file, noiseSeed, openFeatureCache(cacheDirectory, checkVersion=False))
+
+
+def buildAudioDataset(directory=dataDir, workers=workers, checkpointDirectory=checkpointDir, seed=seed,
+                      cacheDirectory=featureCacheDir):
+    # Build the dataset rows of every .wav file under directory, spread over `workers` processes.
+    # Rows always come out in the same order and, with a fixed seed, with the same values whatever
+    # the number of workers. With a checkpointDirectory, finished files are saved one by one and
+    # skipped when an interrupted build is started again. With a cacheDirectory, the PCP of every
+    # file and augmentation is cached by file contents, so only new or changed clips are computed.
+    if plotPCP and workers != 1:
+        raise ValueError("plotPCP only works with workers=1")
+
+    wavFiles = listWavFiles(directory)
+    results = [None] * len(wavFiles)
+    tasks = []
+    # Checks the version of the cache here, once, before any worker writes to it
+    openFeatureCache(cacheDirectory)
+
+    for i, (chordLabel, file) in enumerate(wavFiles):
+        noiseSeed = fileSeed(chordLabel, file, seed)
+        if checkpointDirectory is not None:
+            results[i] = loadCheckpoint(checkpointDirectory, directory, chordLabel, file, noiseSeed)
+        if results[i] is None:
+            tasks.append((i, (directory, chordLabel, file, noiseSeed, cacheDirectory)))
+
+    print(f"Processing {len(tasks)} of {len(wavFiles)} files, {len(wavFiles) - len(tasks)} from checkpoints")
+
+    def finished(i, rows):
+        _, chordLabel, file, noiseSeed, _ = tasks[i][1]
+        print("\t" + chordLabel + "/" + file)
+        results[tasks[i][0]] = rows
+        if checkpointDirectory is not None:
+            saveCheckpoint(checkpointDirectory, directory, chordLabel, file, noiseSeed, rows)
+
+    if workers == 1:
+        for i, (_, task) in enumerate(tasks):
+            finished(i, processTask(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Checkpoint every file as soon as it is done, results are put back in order by their index
+            futures = {executor.submit(processTask, task): i for i, (_, task) in enumerate(tasks)}
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+
+    if cacheDirectory is not None and tasks:
+        removed = openFeatureCache(cacheDirectory).evict()
+        if removed:
+            print(f"Evicted {removed} entries from the feature cache")
+
+    return [row for rows in results for row in rows]
+
+
+def versionNames():
+    # Names of the rows every .wav file produces, in the order they are added to the dataset
+    if augmentData:
+        return ["normal", "reverb", "noise", "stretch"]
+    return ["normal"]
+
+
+def rowMetadata(directory):
+    # (source file, augmentation) of every dataset row built from directory
+    sources, augmentations = [], []
+    for chordLabel, file in listWavFiles(directory):
+        for name in versionNames():
+            sources.append(chordLabel + "/" + file)
+            augmentations.append(name)
+    return sources, augmentations
+
+
+def saveFeatureStore(dataset, directory, storeDirectory):
+    sources, augmentations = rowMetadata(directory)
+    if len(sources) != len(dataset):
+        raise ValueError("The dataset rows do not match the .wav files in " + directory)
+
+    pcps = [row[:12] for row in dataset]
+    labels = [row[12] for row in dataset]
+    writeFeatureStore(storeDirectory, pcps, labels, sources, augmentations)
+
+    print(f"Data saved to {storeDirectory}")
+
+
+def saveCSV(dataset, csvFilePath):
+    import pandas as pd
+
+    # Convert the dataset to a pandas DataFrame
+    df = pd.DataFrame(dataset, columns=columnNames)
+
+    # Save the DataFrame to a CSV file
+    df.to_csv(csvFilePath, index=False)  # Save to CSV without row indices
+
+    print(f"Data saved to {csvFilePath}")
+
+
+def main():
+    # Process .wav files and create a dataset
+    dataset = buildAudioDataset(dataDir, workers, checkpointDir, seed, featureCacheDir)
 
-# Set column names
-df.columns = columnNames
+    if outputFormat in ("csv", "both"):
+        saveCSV(dataset, csvFilePath)
+    if outputFormat in ("store", "both"):
+        saveFeatureStore(dataset, dataDir, featureStoreDir)
 
-# Save the DataFrame to a CSV file
-csvFilePath = "multimodal-guitar-chord-recog/audioPCP.csv" 
-df.to_csv(csvFilePath, index=False)  # Save to CSV without row indices
 
-print(f"Data saved to {csvFilePath}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
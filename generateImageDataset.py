@@ -1,61 +1,91 @@
 import cv2
-import mediapipe as mp
 from image import Image
+from handTracker import HandTracker, preloadMediapipe
 from guitarFunctions import *
+from framePipeline import FramePipeline
+from fretboardTracker import FretboardTracker
+from fretboardParams import loadProfile
+from profiler import profiler
+from imageStore import compileImageStore
 import traceback
 import os
 
 cameraNumber = 0
+sourcePath = None  # a video file or a directory of images to use instead of the camera
+pipelineWorkers = 1  # threads running processFrame, each with its own hand tracker
 printErrors = False
-
-# Importing required modules from mediapipe
-mpDrawing = mp.solutions.drawing_utils
-mpHands = mp.solutions.hands
-
-# Specify the drawing specifications for the landmarks and connections
-handLandmarkDrawingSpec = mpDrawing.DrawingSpec(color=(0, 0, 255), thickness=4, circle_radius=4)
-handConnectionDrawingSpec = mpDrawing.DrawingSpec(color=(0, 255, 0), thickness=6, circle_radius=8)
+printPipelineStats = True
+detectHands = True
+trackFretboard = True  # only run the full hough detection when the tracked fretboard is lost
+fretboardProfile = None  # name of a profile saved by calibration.py, None for the default thresholds
+profileStages = False  # time every stage of the fretboard detection and count why frames are rejected
+profileExportPath = None  # .json or .csv file the profile of the session is written to
+warmUpModels = True  # run the first (slow) fretboard and hand detections before capturing starts
+updateImageStore = True  # append the captured crops to the fixed size image store (imageStore.py) at the end
 
 # Function to create a folder
 def create_folder(folder_name):
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-def processFrame(frame):
+
+class FrameWorker:
+    # What one thread keeps from frame to frame: its detection thresholds, hand tracker and fretboard tracker
+    def __init__(self):
+        self.params = loadProfile(fretboardProfile) if fretboardProfile else None
+        self.handTracker = HandTracker() if detectHands else None
+        if warmUpModels:
+            warmUpDetection(params=self.params)
+            if self.handTracker is not None:
+                self.handTracker.warmUp()
+        self.fretboardTracker = FretboardTracker(params=self.params) if trackFretboard else None
+
+    def close(self):
+        if self.handTracker is not None:
+            self.handTracker.close()
+
+
+def processFrame(frame, worker=None):
 
     # Create an Image object
     chordImage = Image(image=frame)
 
+    handTracker = worker.handTracker if worker is not None else None
+    fretboardTracker = worker.fretboardTracker if worker is not None else None
+    params = worker.params if worker is not None else None
+
     # Rotate and crop the frame
-    rotatedImage = rotateNeck(chordImage)
-    if rotatedImage:
-        croppedCoordinates = isolateNeck(rotatedImage)
+    if fretboardTracker is not None:
+        rotatedImage, croppedCoordinates = fretboardTracker.update(chordImage)
+    else:
+        rotatedImage = rotateNeck(chordImage, params=params)
+        croppedCoordinates = isolateNeck(rotatedImage, params=params) if rotatedImage else None
 
+    if rotatedImage:
         if croppedCoordinates:
             firstH, lastH, firstV, lastV = croppedCoordinates
 
-            # Process the image using the hands object
-            # Convert the image to RGB color space
-            hands = mpHands.Hands(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-            results = hands.process(cv2.cvtColor(rotatedImage.image, cv2.COLOR_BGR2RGB))
+            # Detect the hands with the tracker that lives across frames and draw them.
+            # Only crops with a hand on the fretboard are kept for the dataset
+            if handTracker is not None:
+                with profiler.stage("hands.detect"):
+                    results = handTracker.process(rotatedImage.image)
+                if not results.multi_hand_landmarks:
+                    return None
+                with profiler.stage("hands.draw"):
+                    handTracker.draw(rotatedImage.image, results)
 
-            if results.multi_hand_landmarks:
-                for hand_landmarks in results.multi_hand_landmarks:
-                    mpDrawing.draw_landmarks(
-                        image=rotatedImage.image,
-                        landmark_list=hand_landmarks,
-                        connections=mpHands.HAND_CONNECTIONS,
-                        landmark_drawing_spec=handLandmarkDrawingSpec,
-                        connection_drawing_spec=handConnectionDrawingSpec)
-                    
-                isolatedFretboard = rotatedImage.image[firstH - 15:lastH + 15, firstV - 15 :lastV + 15]
+            isolatedFretboard = rotatedImage.image[firstH - 15:lastH + 15, firstV - 15 :lastV + 15]
 
-                isolatedNeck = Image(image=isolatedFretboard)
-                if isolatedNeck:
-                    return isolatedNeck
+            isolatedNeck = Image(image=isolatedFretboard)
+            if isolatedNeck:
+                return isolatedNeck
 
 
 def main():
+    profiler.enabled = profileStages
+    if detectHands:
+        preloadMediapipe()
 
     numberOfImages = 600
     thisChord = "F"
@@ -73,20 +103,21 @@ def main():
     startCapturing = False
     frames = 0
 
-    cap = cv2.VideoCapture(cameraNumber)
-    while True:
-        # Capture a frame from the camera
-        ret, frame = cap.read()
+    # Frames are captured, processed and saved/displayed on separate threads, every worker thread
+    # creates one hand tracker for the whole session
+    source = cameraNumber if sourcePath is None else sourcePath
+    pipeline = FramePipeline(source, processFrame, workers=pipelineWorkers, initWorker=FrameWorker,
+                             printErrors=printErrors)
+    pipeline.start()
 
-        if not ret:
-            break
+    for processed in pipeline.results():
+        frame = processed.frame
+        profiler.frame()
 
         try:
-            isolatedFretBoard = processFrame(frame)
-            if isolatedFretBoard:
-                saveThis = isolatedFretBoard.image
-                if len(saveThis) < 90 or len(saveThis[0]) < 500:
-                    continue
+            isolatedFretBoard = processed.result
+            saveThis = isolatedFretBoard.image if isolatedFretBoard else None
+            if saveThis is not None and len(saveThis) >= 90 and len(saveThis[0]) >= 500:
                 # Display a message indicating that images are being captured
                 cv2.putText(frame, "Capturing...", (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (127, 255, 255), 5)
 
@@ -128,9 +159,19 @@ def main():
         if imageNumber == numberOfImages:
             break
     
-    # Release the camera and close all windows
-    cap.release()
+    # Stop the pipeline, which releases the camera and the hand trackers, and close all windows
+    pipeline.stop()
+    if printPipelineStats:
+        pipeline.printStats()
+    if profileStages:
+        profiler.printSummary()
+        if profileExportPath:
+            profiler.export(profileExportPath, pipeline.stats())
     cv2.destroyAllWindows()
 
+    if updateImageStore and imageNumber:
+        added, replaced = compileImageStore()
+        print(f"Image store: added {added} and replaced {replaced} images")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
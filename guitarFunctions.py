@@ -1,13 +1,38 @@
 import cv2
-import mediapipe as mp
+import threading
 import numpy as np
 
 from typing import *
 from image import Image
-from copy import deepcopy
 from collections import defaultdict
 from math import inf
-from statistics import median
+from fretboardGrid import segmentArray, segmentSlopes, extractGrid
+from fretboardParams import defaultParams
+from profiler import profiler
+
+class FretboardScratch:
+    # Output buffers of the edge detection that are reused from one frame to the next as long as the frame size stays
+    # the same. A scratch must only be used by one thread at a time.
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+
+threadScratches = threading.local()
+
+
+def threadScratch():
+    # The FretboardScratch of the calling thread
+    if not hasattr(threadScratches, "scratch"):
+        threadScratches.scratch = FretboardScratch()
+    return threadScratches.scratch
+
 
 def binarize(image, thresholdValue):
     thisImage = image
@@ -16,6 +41,30 @@ def binarize(image, thresholdValue):
     return thisImage
 
 
+def threshold(image, thresholdValue, dst=None):
+    # binarize in one OpenCV pass (0 up to thresholdValue, 255 above it) into dst, image is left unchanged
+    return cv2.threshold(image, thresholdValue, 255, cv2.THRESH_BINARY, dst=dst)[1]
+
+
+# Closes the gaps along the frets (a dilation and then an erosion with it)
+verticalKernel = np.array([
+    [0, 1, 0],
+    [0, 1, 0],
+    [0, 1, 0],
+    [0, 1, 0]
+], dtype=np.uint8)
+
+
+def lineEdges(gray, dx, dy, thresholdValue, scratch, name):
+    # Thresholded sobelX (dx=1) or sobelY (dy=1) edges of gray. The Sobel and the threshold go to the scratch buffers
+    # name and name + ".binary", so neither allocates per frame and the Sobel output is not overwritten
+    with profiler.stage(name):
+        # the same 3x3 kernel Image.sobelX / sobelY use
+        edges = cv2.Sobel(gray, cv2.CV_8U, dx, dy, dst=scratch.get(name, gray.shape))
+    with profiler.stage(name.split(".")[0] + ".threshold"):
+        return threshold(edges, thresholdValue, dst=scratch.get(name + ".binary", gray.shape))
+
+
 def rotate(imageArray, angle, center=None, scale=1.0):
     (height, width) = imageArray.shape[:2]
 
@@ -27,152 +76,167 @@ def rotate(imageArray, angle, center=None, scale=1.0):
     return cv2.warpAffine(imageArray, rotationMatrix, (width, height))
 
 
-def rotateNeck(image):
-    imageArray = image.image
-    # make a deep copy of the original image arary so that we can draw hough lines on it and display
-    houghImage = deepcopy(image.image)
-
-    edges = image.sobelY()
-
-    edges = binarize(edges, 150)
+def rotateNeck(image, debugImages=None, scratch=None, params=None):
+    # Pass a dict as debugImages to get the detected lines drawn on a copy of the image under "rotation",
+    # otherwise nothing is drawn and no copy is made. params are the FretboardParams to detect with, the
+    # defaults if None
+    angle = neckAngle(image, debugImages, scratch, params)
+    with profiler.stage("rotate"):
+        return Image(image=rotate(image.image, -angle))
 
-    lines = image.probHoughTransform(edges, 30, 50)  # TODO: Calibrate params automatically
-    slopes = []
 
-    if lines is not None:
-        for line in lines:
-            for x1, y1, x2, y2 in line:
-                # calculate slope
-                slopes.append(abs((y2 - y1) / (x2 - x1)))
-                # draw the hough lines detected
-                cv2.line(houghImage, (x1, y1), (x2, y2), (0, 0, 255), 1)  # Draw lines in red
+def neckAngle(image, debugImages=None, scratch=None, params=None):
+    # Angle (in degrees) the neck is tilted by, estimated from the median slope of the string lines
+    if scratch is None:
+        scratch = threadScratch()
+    if params is None:
+        params = defaultParams
 
-        medianSlope = median(slopes)
-        angle = medianSlope * 55
+    imageArray = image.image
+    houghImage = None
+    if debugImages is not None:
+        # make a copy of the original image arary so that we can draw hough lines on it and display
+        houghImage = imageArray.copy()
+        debugImages["rotation"] = houghImage
+
+    edges = lineEdges(image.gray, 0, 1, params.angleThreshold, scratch, "angle.sobelY")
+
+    # calibration.py tunes these per camera setup
+    with profiler.stage("angle.hough"):
+        lines = image.probHoughTransform(edges, params.angleMinLineLength, params.angleMaxLineGap)
+
+    if houghImage is not None:
+        # draw the hough lines detected
+        with profiler.stage("draw"):
+            drawSegments(houghImage, segmentArray(lines), (0, 0, 255), 1)  # Draw lines in red
+
+    # vertical segments have no slope and are left out instead of dividing by zero
+    slopes = segmentSlopes(lines)
+    if len(slopes):
+        angle = float(np.median(slopes)) * 55
     else:
         angle = 0
 
-    return Image(image=rotate(imageArray, -angle))
+    return angle
 
 
-def isolateNeck(image):
+def drawSegments(imageArray, segments, color, thickness):
+    for x1, y1, x2, y2 in segments.tolist():
+        cv2.line(imageArray, (x1, y1), (x2, y2), color, thickness)
 
-    # if image is empty, return
-    if not image:
-        return
 
-    # make a deep copy of the image array that will be cropped, we will later use this to make a new Image object
-    cropThisImageArr = deepcopy(image.image)
+# Why detectFretboardGrid rejected a frame
+rejectionReasons = (
+    "emptyImage",        # no image to work on
+    "noStringLines",     # hough found no string lines
+    "noFretLines",       # hough found no fret lines
+    "boxSize",           # the lines do not span a box of the expected fretboard size
+    "cropOutsideFrame",  # the crop around the box falls outside the frame
+    "cropSize",          # the crop is not within the min/max fretboard size
+    "noBridge",          # the bridge is not at the end of the crop
+)
 
-    # cv2.imshow("Rotated image", image_to_crop)
 
-    # image on which we will draw the horizontal lines
-    horizontalLinesImage = deepcopy(image.image)
-    # image on which we will draw the vertical lines
-    verticalLinesImage = deepcopy(image.image)
-    # image on which we will draw both horizontal and vertical lines
-    gridImage = deepcopy(image.image)
+def isolateNeck(image, debugImages=None, scratch=None, params=None):
+    # Returns the (firstH, lastH, firstV, lastV) box of the fretboard or None. The image is only read, crops of it
+    # are views. Pass a dict as debugImages to get the detected lines drawn on copies of the image under
+    # "horizontal", "vertical" and "grid" and the accepted crop under "crop", otherwise nothing is drawn and no copy
+    # is made.
+    return isolateNeckWithReason(image, debugImages, scratch, params)[0]
 
 
-    # -------DETECTING HORIZONTAL LINES ALONG THE STRINGS------- #
+def isolateNeckWithReason(image, debugImages=None, scratch=None, params=None):
+    # Returns the box like isolateNeck and why it was rejected, one of rejectionReasons (None when it was not)
+    grid, reason = detectFretboardGrid(image, debugImages, scratch, params)
+    profiler.count("rejected." + reason if reason else "accepted")
+    if grid is None:
+        return None, reason
+    return (grid.firstH, grid.lastH, grid.firstV, grid.lastV), None
 
-    # detecting sobelY edges on the input image
-    stringEdges = image.sobelY()
-    stringEdges = binarize(stringEdges, 100)
-
-    stringHoughLines = image.probHoughTransform(stringEdges, 50, 50)
-
-    horizontalLines = []
-    horizontalSlopeThreshold = 10
-    horizontalDiffThreshold = 6
-
-    if stringHoughLines is None:
-        return None
 
-    for line in stringHoughLines:
-        for x1, y1, x2, y2 in line:
-            # check if the line is straight or not
-            # i.e., (1, 1) ----- (1, 1) is a straight line
-            # since the lines will not always be straight, check against a threshold
-            if abs(y2 - y1) < horizontalSlopeThreshold: 
-                horizontalLines.append(y1)
-                horizontalLines.append(y2)
-                cv2.line(horizontalLinesImage, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                cv2.line(gridImage, (x1, y1), (x2, y2), (0, 0, 255), 2)
+def findFretboardGrid(image, debugImages=None, scratch=None, params=None):
+    # Returns the FretboardGrid (string and fret positions and the box) of the fretboard or None, see isolateNeck
+    return detectFretboardGrid(image, debugImages, scratch, params)[0]
 
-    sortedHorizontalLines = list(sorted(horizontalLines))
-    horizontalDiff = [0]
 
-    firstH = 0
-    lastH = inf
-
-    for i in range(len(sortedHorizontalLines) - 1):
-        horizontalDiff.append(sortedHorizontalLines[i + 1] - sortedHorizontalLines[i])
-
-    for i in range(len(horizontalDiff) - 1):
-        if horizontalDiff[i] < horizontalDiffThreshold:
-            lastH = sortedHorizontalLines[i]
-            if i > 3 and firstH == 0:
-                firstH = sortedHorizontalLines[i]
+def detectFretboardGrid(image, debugImages=None, scratch=None, params=None):
+    # Returns the FretboardGrid of the fretboard and None, or None and the rejection reason
 
+    # if image is empty, return
+    if not image:
+        return None, "emptyImage"
 
-    # -------DETECTING VERTICAL LINES ALONG THE FRETS------- #
+    if scratch is None:
+        scratch = threadScratch()
+    if params is None:
+        params = defaultParams
 
+    # the image array that will be cropped
+    cropThisImageArr = image.image
 
-    fretEdges = image.sobelX()
-    fretEdges = binarize(fretEdges, 100)
+    horizontalLinesImage = verticalLinesImage = gridImage = None
+    if debugImages is not None:
+        # image on which we will draw the horizontal lines
+        horizontalLinesImage = image.image.copy()
+        # image on which we will draw the vertical lines
+        verticalLinesImage = image.image.copy()
+        # image on which we will draw both horizontal and vertical lines
+        gridImage = image.image.copy()
+        debugImages.update(horizontal=horizontalLinesImage, vertical=verticalLinesImage, grid=gridImage)
 
-    verticalKernel = np.array([
-        [0, 1, 0],
-        [0, 1, 0],
-        [0, 1, 0],
-        [0, 1, 0]
-    ], dtype=np.uint8)
 
-    # Perform dilation to close gaps between edges
-    dilatedFrets = cv2.dilate(fretEdges, verticalKernel, iterations=1)
+    # -------DETECTING HORIZONTAL LINES ALONG THE STRINGS------- #
 
-    # Perform erosion to restore the original size while keeping the gaps closed
-    closedFrets = cv2.erode(dilatedFrets, verticalKernel, iterations=1)
+    # detecting sobelY edges on the input image
+    stringEdges = lineEdges(image.gray, 0, 1, params.stringThreshold, scratch, "strings.sobelY")
 
-    fretEdges = closedFrets
+    with profiler.stage("strings.hough"):
+        stringHoughLines = image.probHoughTransform(stringEdges, params.stringMinLineLength, params.stringMaxLineGap)
 
-    fretHoughLines = image.probHoughTransform(fretEdges, 50, 50)
+    horizontalSlopeThreshold = params.horizontalSlopeThreshold
+    horizontalDiffThreshold = params.horizontalDiffThreshold
 
-    verticalLines = []
-    verticalSlopeThreshold = 5
-    verticalDiffThreshold = 10
+    if stringHoughLines is None:
+        return None, "noStringLines"
 
-    if fretHoughLines is None:
-        return None
 
-    for line in fretHoughLines:
-        for x1, y1, x2, y2 in line:
-            if abs(x1 - x2) < verticalSlopeThreshold:
-                verticalLines.append(x1)
-                verticalLines.append(x2)
-                cv2.line(verticalLinesImage, (x1, y1), (x2, y2), (0, 255, 0), 1)
-                cv2.line(gridImage, (x1, y1), (x2, y2), (0, 255, 0), 1)
+    # -------DETECTING VERTICAL LINES ALONG THE FRETS------- #
 
 
-    sortedVerticalLines = list(sorted(verticalLines))
-    verticalDiff = [0]
+    fretEdges = lineEdges(image.gray, 1, 0, params.fretThreshold, scratch, "frets.sobelX")
 
-    firstV = 0
-    lastV = inf
+    with profiler.stage("frets.close"):
+        # Close the gaps between edges along the frets, a dilation followed by an erosion in one call
+        fretEdges = cv2.morphologyEx(fretEdges, cv2.MORPH_CLOSE, verticalKernel,
+                                     dst=scratch.get("frets.closed", fretEdges.shape))
 
-    for i in range(len(sortedVerticalLines) - 1):
-        verticalDiff.append(sortedVerticalLines[i + 1] - sortedVerticalLines[i])
+    with profiler.stage("frets.hough"):
+        fretHoughLines = image.probHoughTransform(fretEdges, params.fretMinLineLength, params.fretMaxLineGap)
 
-    for i in range(len(verticalDiff) - 1):
-        if verticalDiff[i] < verticalDiffThreshold:
-            lastV = sortedVerticalLines[i]
-            if i > 2 and firstV == 0:
-                firstV = sortedVerticalLines[i]
+    verticalSlopeThreshold = params.verticalSlopeThreshold
+    verticalDiffThreshold = params.verticalDiffThreshold
 
-    
+    if fretHoughLines is None:
+        return None, "noFretLines"
+
+    if gridImage is not None:
+        with profiler.stage("draw"):
+            # check if the line is straight or not, since the lines will not always be straight check against a
+            # threshold
+            stringSegments = segmentArray(stringHoughLines)
+            stringSegments = stringSegments[np.abs(stringSegments[:, 3] - stringSegments[:, 1]) < horizontalSlopeThreshold]
+            fretSegments = segmentArray(fretHoughLines)
+            fretSegments = fretSegments[np.abs(fretSegments[:, 0] - fretSegments[:, 2]) < verticalSlopeThreshold]
+            for linesImage in (horizontalLinesImage, gridImage):
+                drawSegments(linesImage, stringSegments, (0, 0, 255), 2)
+            for linesImage in (verticalLinesImage, gridImage):
+                drawSegments(linesImage, fretSegments, (0, 255, 0), 1)
+
+    with profiler.stage("grid"):
+        grid = extractGrid(stringHoughLines, fretHoughLines, horizontalSlopeThreshold, horizontalDiffThreshold,
+                           verticalSlopeThreshold, verticalDiffThreshold)
+    firstH, lastH, firstV, lastV = grid.firstH, grid.lastH, grid.firstV, grid.lastV
 
-    cv2.imshow("Image with vertical and horizontal hough lines", gridImage)
 
     # get the last V and H coordinate (X and Y)
     if lastV == inf:
@@ -181,50 +245,60 @@ def isolateNeck(image):
         lastH = len(cropThisImageArr) - 1
 
     # Expected fretboard dimensions
-    expectedFretboardWidth, expectedFretboardHeight = 600, 100
-    minFretboardWidth, minFretboardHeight = 550, 100
-    maxFretboardWidth, maxFretboardHeight = 650, 120
-    fretboardThreshold = 50
+    expectedFretboardWidth, expectedFretboardHeight = params.expectedWidth, params.expectedHeight
+    minFretboardWidth, minFretboardHeight = params.minWidth, params.minHeight
+    maxFretboardWidth, maxFretboardHeight = params.maxWidth, params.maxHeight
+    fretboardThreshold = params.sizeTolerance
 
     # Calculate the width and height of the detected fretboard
     detectedFretboardWidth, detectedFretboardHeight = lastV - firstV, lastH - firstH
     
     # Check if the detected size is within the expected range
-    if (abs(detectedFretboardWidth - expectedFretboardWidth) <= fretboardThreshold 
-        and abs(detectedFretboardHeight - expectedFretboardHeight) <= fretboardThreshold):
-        
-        # print("----------")
-        # print("detectedFretboardWidth", detectedFretboardWidth)
-        # print("expectedFretboardHeight", detectedFretboardHeight)
-        # print("----------")
-
-        # Coordinates are close to the expected size, proceed with cropping
-        isolatedFretboard = cropThisImageArr[firstH - 15:lastH + 15, firstV :lastV + 15] 
-
-        # return the cropped Image object only if it is a valid fretboard crop and the bridge (white part at start of the board)
-        # is present in this crop
-        if (bridgePresent(isolatedFretboard) 
-            and( maxFretboardHeight > len(isolatedFretboard) > minFretboardHeight) 
+    if (abs(detectedFretboardWidth - expectedFretboardWidth) > fretboardThreshold
+        or abs(detectedFretboardHeight - expectedFretboardHeight) > fretboardThreshold):
+        # Detected size is not close to expected, return None
+        return None, "boxSize"
+
+    # Coordinates are close to the expected size, proceed with cropping
+    isolatedFretboard = cropThisImageArr[firstH - 15:lastH + 15, firstV :lastV + 15]
+    if isolatedFretboard.size == 0:
+        return None, "cropOutsideFrame"
+
+    # return the box only if it is a valid fretboard crop and the bridge (white part at start of the board)
+    # is present in this crop
+    if not ((maxFretboardHeight > len(isolatedFretboard) > minFretboardHeight)
             and (maxFretboardWidth > len(isolatedFretboard[0]) > minFretboardWidth)):
-            print(isolatedFretboard.shape)
-            return firstH, lastH, firstV, lastV
-        
-    # Detected size is not close to expected, return None
-    return None
+        return None, "cropSize"
+    with profiler.stage("bridge"):
+        bridge = bridgePresent(isolatedFretboard, params.bridgeWhitePixels)
+    if not bridge:
+        return None, "noBridge"
+
+    if debugImages is not None:
+        debugImages["crop"] = isolatedFretboard
+    return grid._replace(lastH=lastH, lastV=lastV), None
+
 
+def warmUpDetection(frameShape=(480, 640, 3), params=None):
+    # The first detection in a process is several times slower than the next ones: np.median imports numpy.ma on its
+    # first call and OpenCV sets up its first Sobel, hough and warpAffine calls. Running the detection once on a
+    # synthetic frame of string and fret lines moves that out of the first real frame. The scratch buffers of the
+    # calling thread are sized for frameShape on the way.
+    frame = np.zeros(frameShape, dtype=np.uint8)
+    frame[::20] = 255
+    frame[:, ::40] = 255
+    rotatedImage = rotateNeck(Image(image=frame), params=params)
+    detectFretboardGrid(rotatedImage, params=params)
 
-def bridgePresent(board):
 
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+def bridgePresent(board, whitePixels=1300):
 
-    # Define a threshold to determine what is considered as white
-    whitePixels = 1300 
+    # whitePixels is the threshold to determine what is considered as white
 
-    # Extract the rightmost region of interest (ROI) with a small width
-    rightmostROI = gray[:, -20:]
+    # Extract the rightmost region of interest (ROI) with a small width and convert only that to grayscale
+    rightmostROI = cv2.cvtColor(board[:, -20:], cv2.COLOR_BGR2GRAY)
 
-    binary = binarize(rightmostROI, 127)
+    binary = threshold(rightmostROI, 127, dst=rightmostROI)
 
     # Count the number of white pixels in the rightmost ROI
     whitePixelCount = cv2.countNonZero(binary)
@@ -0,0 +1,111 @@
+import cv2
+import threading
+import numpy as np
+
+# mediapipe takes most of a second to import, it is imported when the first HandTracker is created
+mpDrawing = None
+mpHands = None
+handLandmarkDrawingSpec = None
+handConnectionDrawingSpec = None
+
+# Landmark indices of the finger tips (thumb, index, middle, ring, pinky)
+fingertipLandmarks = (4, 8, 12, 16, 20)
+
+
+def importMediapipe():
+    global mpDrawing, mpHands, handLandmarkDrawingSpec, handConnectionDrawingSpec
+    if mpHands is not None:
+        return
+    import mediapipe as mp
+
+    # Importing required modules from mediapipe
+    mpDrawing = mp.solutions.drawing_utils
+    # Specify the drawing specifications for the landmarks and connections
+    handLandmarkDrawingSpec = mpDrawing.DrawingSpec(color=(0, 0, 255), thickness=4, circle_radius=4)
+    handConnectionDrawingSpec = mpDrawing.DrawingSpec(color=(0, 255, 0), thickness=6, circle_radius=8)
+    mpHands = mp.solutions.hands
+
+
+def preloadMediapipe():
+    # Import mediapipe on a background thread, e.g. while the camera is opened. The first HandTracker waits for it
+    thread = threading.Thread(target=importMediapipe, name="importMediapipe", daemon=True)
+    thread.start()
+    return thread
+
+
+class HandTracker():
+    # One MediaPipe Hands detector that lives as long as the tracker. In video mode MediaPipe tracks the hands from
+    # frame to frame instead of running the palm detector on every frame. Use as a context manager or call close().
+    def __init__(self, maxNumHands=2, minDetectionConfidence=0.5, minTrackingConfidence=0.5, staticImageMode=False):
+        importMediapipe()
+        self.hands = mpHands.Hands(
+            static_image_mode=staticImageMode,
+            max_num_hands=maxNumHands,
+            min_detection_confidence=minDetectionConfidence,
+            min_tracking_confidence=minTrackingConfidence)
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.hands is not None:
+            self.hands.close()
+            self.hands = None
+
+    def process(self, image):
+        # Run the detector on a BGR image, returns the MediaPipe results
+        if self.hands is None:
+            raise RuntimeError("HandTracker is closed")
+
+        rgbImage = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        # Lets MediaPipe use the array without copying it
+        rgbImage.flags.writeable = False
+        self.results = self.hands.process(rgbImage)
+        self.imageShape = image.shape[:2]
+        return self.results
+
+    def warmUp(self, frameShape=(480, 640, 3)):
+        # The first inference sets up the MediaPipe graph and takes several times as long as the following ones,
+        # run it on a blank frame before the camera starts
+        self.process(np.zeros(frameShape, dtype=np.uint8))
+        self.results = None
+
+    def landmarks(self, results=None, pixels=True):
+        # (number of hands, 21, 3) array of x, y, z. With pixels=True x and y are in pixels of the processed image,
+        # otherwise normalized to [0, 1]
+        if results is None:
+            results = self.results
+        if results is None or not results.multi_hand_landmarks:
+            return np.empty((0, 21, 3))
+
+        landmarks = np.array([[(point.x, point.y, point.z) for point in hand.landmark]
+                              for hand in results.multi_hand_landmarks])
+        if pixels:
+            height, width = self.imageShape
+            landmarks[..., 0] *= width
+            landmarks[..., 1] *= height
+        return landmarks
+
+    def fingertips(self, results=None, pixels=True):
+        # (number of hands, 5, 3) landmarks of the finger tips only
+        return self.landmarks(results, pixels)[:, fingertipLandmarks]
+
+    def draw(self, image, results=None):
+        # Draw the landmarks and connections of every detected hand onto image (in place)
+        if results is None:
+            results = self.results
+        if results is None or not results.multi_hand_landmarks:
+            return image
+
+        for hand_landmarks in results.multi_hand_landmarks:
+            mpDrawing.draw_landmarks(
+                image=image,
+                landmark_list=hand_landmarks,
+                connections=mpHands.HAND_CONNECTIONS,
+                landmark_drawing_spec=handLandmarkDrawingSpec,
+                connection_drawing_spec=handConnectionDrawingSpec)
+        return image
@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-from matplotlib import pyplot as plt
 
 
 class Image:
@@ -38,6 +37,7 @@ class Image:
     def setGray(self, grayscale):
         self.gray = grayscale
 
+    # ksize lands in the dst position of cv2.Sobel, so both use OpenCV's default 3x3 kernel.
     def sobelX(self, ksize=5):
         return cv2.Sobel(self.gray, cv2.CV_8U, 1, 0, ksize)
 
@@ -45,5 +45,6 @@ class Image:
         return cv2.Sobel(self.gray, cv2.CV_8U, 0, 1, ksize)
 
     def probHoughTransform(self, edges, minLineLength, MaxLineGap, threshold=20):
-        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold, minLineLength, MaxLineGap)
+        # By keyword, the fifth positional argument of cv2.HoughLinesP is its lines output
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold, minLineLength=minLineLength, maxLineGap=MaxLineGap)
         return lines
\ No newline at end of file
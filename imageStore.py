@@ -0,0 +1,240 @@
+import os
+import cv2
+import json
+import numpy as np
+from framePipeline import imageExtensions
+
+imageDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chords")
+imageStoreDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chords_store")
+storeVersion = 1
+
+
+# Fixed size copy of the chords/ crops. A store is a directory with
+#   images.u8         uint8 (n, height, width, channels) raw array, BGR or grayscale (channels 1)
+#   labels.u8         uint8 (n,) index into meta.json "labels"
+#   sizes.i32         int32 (n, 2) height and width of every crop before resizing
+#   meta.json         the image layout, the label table, the source file and its modification time of every image
+#                     and the number of images
+# The raw files only grow: new images are appended and meta.json is replaced last, so a reader (or an interrupted
+# append) never sees more images than meta.json counts. Crops generateImageDataset overwrites (it numbers every
+# session from 0.jpg) are rewritten in place. Reading memory-maps the files, so opening a store and slicing
+# contiguous batches copies nothing.
+
+
+def storePaths(directory):
+    return {name: os.path.join(directory, name) for name in ("images.u8", "labels.u8", "sizes.i32", "meta.json")}
+
+
+def readMeta(directory):
+    path = storePaths(directory)["meta.json"]
+    if not os.path.exists(path):
+        return None
+    with open(path) as metaFile:
+        return json.load(metaFile)
+
+
+def writeMeta(directory, meta):
+    path = storePaths(directory)["meta.json"]
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "w") as metaFile:
+        json.dump(meta, metaFile, indent=1)
+    os.replace(temporaryPath, path)
+
+
+def listCrops(directory=imageDir):
+    # (label, path relative to directory) of every crop, labels in sorted order and crops in capture order
+    crops = []
+    for chordLabel in sorted(os.listdir(directory)):
+        chordDir = os.path.join(directory, chordLabel)
+        if not os.path.isdir(chordDir):
+            continue
+        files = [file for file in os.listdir(chordDir) if file.lower().endswith(imageExtensions)]
+        # generateImageDataset numbers the crops, keep that order
+        files.sort(key=lambda file: (0, int(os.path.splitext(file)[0]), "") if os.path.splitext(file)[0].isdigit()
+                   else (1, 0, file))
+        crops += [(chordLabel, chordLabel + "/" + file) for file in files]
+    return crops
+
+
+def normalizeCrop(crop, width, height, channels):
+    if channels == 1:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA).reshape(height, width, channels)
+
+
+def checkLayout(directory, meta, width, height, channels):
+    if (meta["version"], meta["width"], meta["height"], meta["channels"]) != (storeVersion, width, height, channels):
+        raise ValueError(f"Image store {directory} has a different layout, compile it into a new directory")
+
+
+def appendImages(directory, images, labels, sources, sizes, modified, width, height, channels):
+    # Append already normalized images to a store, creating it if needed. Returns the new number of images
+    meta = readMeta(directory)
+    if meta is None:
+        os.makedirs(directory, exist_ok=True)
+        meta = {"version": storeVersion, "width": width, "height": height, "channels": channels, "count": 0,
+                "labels": [], "sources": [], "modified": []}
+    else:
+        checkLayout(directory, meta, width, height, channels)
+
+    # New labels go to the end of the table so the codes of the stored images stay valid
+    for label in labels:
+        if label not in meta["labels"]:
+            meta["labels"].append(label)
+    if len(meta["labels"]) > 255:
+        raise ValueError("An image store holds at most 255 labels")
+
+    arrays = {
+        "images.u8": np.asarray(images, dtype=np.uint8).reshape(len(labels), height, width, channels),
+        "labels.u8": np.array([meta["labels"].index(label) for label in labels], dtype=np.uint8),
+        "sizes.i32": np.asarray(sizes, dtype=np.int32).reshape(len(labels), 2),
+    }
+    paths = storePaths(directory)
+    for name, array in arrays.items():
+        with open(paths[name], "ab") as dataFile:
+            # Drop whatever an interrupted append left behind the last counted image
+            dataFile.truncate(meta["count"] * array.itemsize * int(np.prod(array.shape[1:])))
+            dataFile.write(np.ascontiguousarray(array).tobytes())
+
+    meta["count"] += len(labels)
+    meta["sources"] += list(sources)
+    meta["modified"] += list(modified)
+    writeMeta(directory, meta)
+    return meta["count"]
+
+
+def replaceImages(directory, rows, images, sizes, modified):
+    # Overwrite the stored images at rows, e.g. with crops that were captured again under the same file name
+    meta = readMeta(directory)
+    paths = storePaths(directory)
+    shape = (meta["count"], meta["height"], meta["width"], meta["channels"])
+    storedImages = np.memmap(paths["images.u8"], dtype=np.uint8, mode="r+", shape=shape)
+    storedSizes = np.memmap(paths["sizes.i32"], dtype=np.int32, mode="r+", shape=(meta["count"], 2))
+    storedImages[rows] = np.asarray(images, dtype=np.uint8).reshape((len(rows),) + shape[1:])
+    storedSizes[rows] = np.asarray(sizes, dtype=np.int32).reshape(len(rows), 2)
+    storedImages.flush()
+    storedSizes.flush()
+    del storedImages, storedSizes
+
+    for row, time in zip(rows, modified):
+        meta["modified"][row] = time
+    writeMeta(directory, meta)
+
+
+def readCrops(imageDirectory, crops, width, height, channels):
+    # Normalized images, sizes and modification times of the (label, source) crops that can be decoded
+    images, labels, sources, sizes, modified = [], [], [], [], []
+    for label, source in crops:
+        path = os.path.join(imageDirectory, source)
+        crop = cv2.imread(path)
+        if crop is None:
+            continue
+        images.append(normalizeCrop(crop, width, height, channels))
+        labels.append(label)
+        sources.append(source)
+        sizes.append(crop.shape[:2])
+        modified.append(os.path.getmtime(path))
+    return images, labels, sources, sizes, modified
+
+
+def compileImageStore(imageDirectory=imageDir, storeDirectory=imageStoreDir, width=256, height=48, grayscale=False,
+                      chunkSize=256):
+    # Decode, resize and store every crop under imageDirectory that is not in the store yet. Running it again after
+    # capturing more images with generateImageDataset only appends the new ones (and rewrites overwritten ones).
+    # Returns the number of added and of replaced images
+    channels = 1 if grayscale else 3
+    meta = readMeta(storeDirectory)
+    storedRows = {}
+    if meta is not None:
+        checkLayout(storeDirectory, meta, width, height, channels)
+        storedRows = {source: row for row, source in enumerate(meta["sources"])}
+
+    newCrops, changedCrops = [], []
+    for label, source in listCrops(imageDirectory):
+        row = storedRows.get(source)
+        if row is None:
+            newCrops.append((label, source))
+        elif os.path.getmtime(os.path.join(imageDirectory, source)) != meta["modified"][row]:
+            changedCrops.append((label, source))
+
+    added = replaced = 0
+    for start in range(0, len(newCrops), chunkSize):
+        images, labels, sources, sizes, modified = readCrops(imageDirectory, newCrops[start:start + chunkSize],
+                                                             width, height, channels)
+        if images:
+            appendImages(storeDirectory, images, labels, sources, sizes, modified, width, height, channels)
+            added += len(images)
+
+    for start in range(0, len(changedCrops), chunkSize):
+        images, labels, sources, sizes, modified = readCrops(imageDirectory, changedCrops[start:start + chunkSize],
+                                                             width, height, channels)
+        if images:
+            replaceImages(storeDirectory, [storedRows[source] for source in sources], images, sizes, modified)
+            replaced += len(images)
+
+    if meta is None and not added:
+        raise ValueError(f"No images found under {imageDirectory}")
+    return added, replaced
+
+
+class ImageStore():
+
+    def __init__(self, directory=imageStoreDir):
+        self.directory = directory
+        meta = readMeta(directory)
+        if meta is None:
+            raise FileNotFoundError(storePaths(directory)["meta.json"])
+
+        self.count = meta["count"]
+        self.width, self.height, self.channels = meta["width"], meta["height"], meta["channels"]
+        self.labelTable = meta["labels"]
+        self.sources = meta["sources"]
+        self.modified = meta["modified"]
+
+        paths = storePaths(directory)
+        self.images = self.memmap(paths["images.u8"], np.uint8, (self.height, self.width, self.channels))
+        self.labels = self.memmap(paths["labels.u8"], np.uint8, ())
+        self.sizes = self.memmap(paths["sizes.i32"], np.int32, (2,))
+
+    def memmap(self, path, dtype, rowShape):
+        if self.count == 0:
+            return np.empty((0,) + rowShape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(self.count,) + rowShape)
+
+    def __len__(self):
+        return self.count
+
+    def labelNames(self, rows=slice(None)):
+        return np.array(self.labelTable)[self.labels[rows]]
+
+    def labelCode(self, label):
+        return self.labelTable.index(label)
+
+    def rows(self, label=None):
+        # Indices of the images with the given label
+        if label is None:
+            return np.arange(len(self))
+        return np.flatnonzero(self.labels == self.labelCode(label))
+
+    def batches(self, batchSize=64, rows=None):
+        # (images, label codes) batches. Without rows they are slices of the memory map, which copy nothing;
+        # an index array (e.g. shuffled rows) has to gather its images into a new array
+        if rows is None:
+            for start in range(0, len(self), batchSize):
+                yield self.images[start:start + batchSize], self.labels[start:start + batchSize]
+        else:
+            rows = np.asarray(rows)
+            for start in range(0, len(rows), batchSize):
+                batch = np.sort(rows[start:start + batchSize])
+                yield self.images[batch], self.labels[batch]
+
+
+def main():
+    added, replaced = compileImageStore()
+    store = ImageStore()
+    print(f"Added {added} and replaced {replaced} images, {len(store)} images of {store.height}x{store.width}x{store.channels} "
+          f"in {imageStoreDir}")
+
+
+if __name__ == '__main__':
+    main()
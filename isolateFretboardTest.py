@@ -1,97 +1,168 @@
 import cv2
-import mediapipe as mp
 from image import Image
+from handTracker import HandTracker, preloadMediapipe
+from framePipeline import FramePipeline
+from fretboardTracker import FretboardTracker
+from fretboardParams import loadProfile
+from fingering import FretboardGeometry, chordShape, drawFingering
+from profiler import profiler
 from guitarFunctions import *
 import traceback
 
 liveFeed = True
 cameraNumber = 0
+sourcePath = None  # a video file or a directory of images to use instead of the camera
+pipelineWorkers = 1  # threads running processFrame, each with its own hand tracker
 printErrors = False
-
-# Importing required modules from mediapipe
-mpDrawing = mp.solutions.drawing_utils
-mpHands = mp.solutions.hands
-
-# Specify the drawing specifications for the landmarks and connections
-handLandmarkDrawingSpec = mpDrawing.DrawingSpec(color=(0, 0, 255), thickness=4, circle_radius=4)
-handConnectionDrawingSpec = mpDrawing.DrawingSpec(color=(0, 255, 0), thickness=6, circle_radius=8)
-
-def processFrame(frame):
-
-    # Display the original and processed frames
-    cv2.imshow('Original', frame)
+printPipelineStats = True
+detectHands = True
+trackFretboard = True  # only run the full hough detection when the tracked fretboard is lost
+fretboardProfile = None  # name of a profile saved by calibration.py, None for the default thresholds
+profileStages = False  # time every stage of the fretboard detection and count why frames are rejected
+profileExportPath = None  # .json or .csv file the profile of the session is written to
+showHoughLines = True  # draw the detected string and fret lines in an extra window
+mapFingertips = True  # write the (string, fret) of every fingertip and the chord shape onto the crop
+warmUpModels = True  # run the first (slow) fretboard and hand detections before capturing starts
+
+class FrameWorker:
+    # What one thread keeps from frame to frame: its detection thresholds, hand tracker and fretboard tracker
+    def __init__(self, liveFeed=True):
+        self.params = loadProfile(fretboardProfile) if fretboardProfile else None
+        self.handTracker = HandTracker(staticImageMode=not liveFeed) if detectHands else None
+        if warmUpModels:
+            warmUpDetection(params=self.params)
+            if self.handTracker is not None:
+                self.handTracker.warmUp()
+        self.fretboardTracker = FretboardTracker(params=self.params) if trackFretboard and liveFeed else None
+        # FretboardGeometry of the last grid, rebuilt only when the fretboard moves
+        self.geometry = None
+
+    def fretboardGeometry(self, grid):
+        box = (grid.firstH, grid.lastH, grid.firstV, grid.lastV)
+        if self.geometry is None or self.geometry.box != box:
+            self.geometry = FretboardGeometry.fromGrid(grid)
+        return self.geometry
+
+    def close(self):
+        if self.handTracker is not None:
+            self.handTracker.close()
+
+
+def processFrame(frame, worker=None):
+    # Returns the isolated neck Image (or None) and the debug images with the hough lines
+
+    # Hough lines are only drawn when they will be shown
+    debugImages = {} if showHoughLines else None
+    isolatedNeck = None
 
     # Create an Image object
     chordImage = Image(image=frame)
 
+    handTracker = worker.handTracker if worker is not None else None
+    fretboardTracker = worker.fretboardTracker if worker is not None else None
+    params = worker.params if worker is not None else None
+
     # Rotate and crop the frame
-    rotatedImage = rotateNeck(chordImage)
-    if rotatedImage:
-        croppedCoordinates = isolateNeck(rotatedImage)
+    if fretboardTracker is not None:
+        rotatedImage, croppedCoordinates = fretboardTracker.update(chordImage, debugImages)
+        grid = fretboardTracker.grid() if croppedCoordinates else None
+    else:
+        rotatedImage = rotateNeck(chordImage, params=params)
+        grid = findFretboardGrid(rotatedImage, debugImages, params=params) if rotatedImage else None
+        croppedCoordinates = (grid.firstH, grid.lastH, grid.firstV, grid.lastV) if grid else None
 
+    if rotatedImage:
         if croppedCoordinates:
             firstH, lastH, firstV, lastV = croppedCoordinates
 
-            # Process the image using the hands object
-            # Convert the image to RGB color space
-            hands = mpHands.Hands(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-            results = hands.process(cv2.cvtColor(rotatedImage.image, cv2.COLOR_BGR2RGB))
-
-            if results.multi_hand_landmarks:
-                for hand_landmarks in results.multi_hand_landmarks:
-                    mpDrawing.draw_landmarks(
-                        image=rotatedImage.image,
-                        landmark_list=hand_landmarks,
-                        connections=mpHands.HAND_CONNECTIONS,
-                        landmark_drawing_spec=handLandmarkDrawingSpec,
-                        connection_drawing_spec=handConnectionDrawingSpec)
-                    
+            # Detect the hands with the tracker that lives across frames and draw them
+            if handTracker is not None:
+                with profiler.stage("hands.detect"):
+                    results = handTracker.process(rotatedImage.image)
+                with profiler.stage("hands.draw"):
+                    handTracker.draw(rotatedImage.image, results)
+
+                # Where the fingertips are on the fretboard, all hands at once
+                if mapFingertips and grid is not None and results.multi_hand_landmarks:
+                    with profiler.stage("hands.fingering"):
+                        landmarks = handTracker.landmarks(results)
+                        fingering = worker.fretboardGeometry(grid).fingering(landmarks)
+                        drawFingering(rotatedImage.image, landmarks, fingering)
+                        shape = " ".join(str(fret) for fret in chordShape(fingering))
+                        cv2.putText(rotatedImage.image, shape, (firstV, firstH - 3), cv2.FONT_HERSHEY_SIMPLEX, 0.4,
+                                    (255, 255, 0), 1)
+
             isolatedFretboard = rotatedImage.image[firstH - 15:lastH + 15, firstV - 15 :lastV + 15]
 
             isolatedNeck = Image(image=isolatedFretboard)
-            if isolatedNeck:
-                cv2.imshow('Cropped neck image', isolatedNeck.image)
-            
+
+    return isolatedNeck, debugImages
+
+
+def showFrame(frame, processed):
+    # Display the original and processed frames
+    cv2.imshow('Original', frame)
+    if processed is None:
+        return
+
+    isolatedNeck, debugImages = processed
+    if debugImages and "grid" in debugImages:
+        cv2.imshow("Image with vertical and horizontal hough lines", debugImages["grid"])
+    if isolatedNeck:
+        cv2.imshow('Cropped neck image', isolatedNeck.image)
+
 
 def main():
-    # Create a hands object from mediapipe
+    profiler.enabled = profileStages
+    if detectHands:
+        preloadMediapipe()
+
     if liveFeed:
-        cap = cv2.VideoCapture(cameraNumber)
-        while True:
-            # Capture a frame from the camera
-            ret, frame = cap.read()
-
-            if not ret:
-                break
-
-            try:
-                processFrame(frame)
-            except Exception as e:
-               if printErrors:
-                   traceback.print_exc()
-            
-            # Exit the loop if the 'q' key is pressed
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-        
-        # Release the camera and close all windows
-        cap.release()
+        # Frames are captured, processed and displayed on separate threads, every worker thread
+        # creates one hand tracker for the whole session
+        source = cameraNumber if sourcePath is None else sourcePath
+        pipeline = FramePipeline(source, processFrame, workers=pipelineWorkers, initWorker=FrameWorker,
+                                 printErrors=printErrors)
+
+        with pipeline:
+            for processed in pipeline.results():
+                with profiler.stage("display"):
+                    showFrame(processed.frame, processed.result)
+                profiler.frame()
+
+                # Exit the loop if the 'q' key is pressed
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+        if printPipelineStats:
+            pipeline.printStats()
+        if profileStages:
+            profiler.printSummary()
+            if profileExportPath:
+                profiler.export(profileExportPath, pipeline.stats())
+
+        # Close all windows
         cv2.destroyAllWindows()
 
     else:
+        worker = FrameWorker(liveFeed=False)
+
         # Specify the path to the image you want to use
         imagePath = "capstone/17.jpg"
         frame = cv2.imread(imagePath)
 
         if frame is None:
             print("Error: Failed to load the image from the specified path.")
+            worker.close()
             exit(1)
 
         try:
-            processFrame(frame)
+            showFrame(frame, processFrame(frame, worker))
         except Exception as e:
             if printErrors:
                 traceback.print_exc()
 
+        worker.close()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,79 @@
+import numpy as np
+from collections import deque
+
+# Onset detection settings, an onset is a hop whose mean energy is riseRatio times the mean of the hops before it
+hopSize = 512
+riseRatio = 8.0  # about 9 dB
+backgroundHops = 4
+minEnergy = 1e-8  # mean squared amplitude (-80 dBFS), quieter hops count as silence
+peakFraction = 0.05  # offline, an onset must also reach this fraction of the loudest hop of the clip
+# Samples analyzed from the onset on, a power of two so that every PCP uses the same small FFT
+windowSize = 2**15
+
+
+def hopEnergies(samples, hopSize=hopSize):
+    # Mean squared amplitude of every full hop of a (mono or multi channel) signal
+    samples = np.asarray(samples, dtype=np.float64)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    hops = len(samples) // hopSize
+    frames = samples[:hops * hopSize].reshape(hops, hopSize)
+    return np.einsum("ij,ij->i", frames, frames) / hopSize
+
+
+def findOnset(samples, hopSize=hopSize, riseRatio=riseRatio, backgroundHops=backgroundHops, minEnergy=minEnergy,
+              peakFraction=peakFraction):
+    # Sample index of the first onset (the strum) of a clip, 0 for a clip shorter than one hop
+    energies = hopEnergies(samples, hopSize)
+    if not len(energies):
+        return 0
+
+    # Mean of the backgroundHops hops before every hop, silence before the start of the clip
+    cumulative = np.concatenate([[0.0], np.cumsum(energies)])
+    hops = np.arange(len(energies))
+    first = np.maximum(hops - backgroundHops, 0)
+    background = np.full(len(energies), minEnergy)
+    background[1:] = (cumulative[hops[1:]] - cumulative[first[1:]]) / (hops[1:] - first[1:])
+
+    loud = energies >= peakFraction * energies.max()
+    onsets = np.flatnonzero(loud & (energies >= riseRatio * np.maximum(background, minEnergy)))
+    if not len(onsets):
+        # A strum that swells slower than riseRatio starts where the clip gets loud
+        onsets = np.flatnonzero(loud)
+    return int(onsets[0]) * hopSize
+
+
+def onsetWindow(samples, windowSize=windowSize, **onsetSettings):
+    # The windowSize samples from the onset on, zero padded at the end when the clip is shorter
+    samples = np.asarray(samples)
+    onset = findOnset(samples, **onsetSettings)
+    window = samples[onset:onset + windowSize]
+    if len(window) < windowSize:
+        padding = [(0, windowSize - len(window))] + [(0, 0)] * (samples.ndim - 1)
+        window = np.pad(window, padding)
+    return window
+
+
+class OnsetDetector():
+    # Streaming version of findOnset for live audio: update() takes the mean energy of one hop at a time and
+    # returns True for a hop that starts a strum. Onsets closer than refractoryHops to the previous one are ignored
+    def __init__(self, riseRatio=riseRatio, backgroundHops=backgroundHops, minEnergy=minEnergy, refractoryHops=16):
+        self.riseRatio = riseRatio
+        self.minEnergy = minEnergy
+        self.refractoryHops = refractoryHops
+        self.background = deque(maxlen=backgroundHops)
+        self.hopsSinceOnset = refractoryHops
+
+    def reset(self):
+        self.background.clear()
+        self.hopsSinceOnset = self.refractoryHops
+
+    def update(self, energy):
+        background = np.mean(self.background) if self.background else self.minEnergy
+        self.background.append(energy)
+        self.hopsSinceOnset += 1
+
+        if self.hopsSinceOnset > self.refractoryHops and energy >= self.riseRatio * max(background, self.minEnergy):
+            self.hopsSinceOnset = 0
+            return True
+        return False
@@ -0,0 +1,127 @@
+import csv
+import json
+import time
+import threading
+from contextlib import nullcontext
+from collections import Counter, deque
+from framePipeline import StageTimer
+
+# Returned by stage() while profiling is off, entering and leaving it does nothing
+disabledStage = nullcontext()
+
+
+class StageContext():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class Profiler():
+    # Per-stage latencies, event counters (like rejection reasons) and the frame rate of a session. Off by default:
+    # stage() then hands out one shared no-op context and count()/frame() return right away, so the instrumented
+    # code pays a function call per stage. Safe to use from several pipeline workers at once.
+    def __init__(self, enabled=False, historySize=1000):
+        self.enabled = enabled
+        self.historySize = historySize
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = Counter()
+            self.frameTimes = deque(maxlen=self.historySize)
+            self.frames = 0
+            self.startTime = time.perf_counter()
+
+    def stage(self, name):
+        # with profiler.stage("name"): ... times the block under name
+        if not self.enabled:
+            return disabledStage
+        return StageContext(self, name)
+
+    def add(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = StageTimer(self.historySize)
+            timer.add(seconds)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += amount
+
+    def frame(self):
+        # Call once per finished frame for the rolling frame rate
+        if not self.enabled:
+            return
+        with self.lock:
+            self.frameTimes.append(time.perf_counter())
+            self.frames += 1
+
+    def fps(self):
+        # Frame rate over the last historySize frames
+        if len(self.frameTimes) < 2:
+            return 0.0
+        return (len(self.frameTimes) - 1) / (self.frameTimes[-1] - self.frameTimes[0])
+
+    def summary(self):
+        with self.lock:
+            stages = {name: timer.summary() for name, timer in sorted(self.timers.items())}
+            for name, timer in self.timers.items():
+                if timer.times:
+                    stages[name]["totalMs"] = sum(timer.times) * 1e3
+            return {"frames": self.frames, "fps": self.fps(), "elapsed": time.perf_counter() - self.startTime,
+                    "stages": stages, "counters": dict(self.counters)}
+
+    def exportJSON(self, path, extra=None):
+        # Summary of the session as JSON, extra (e.g. FramePipeline.stats()) is stored under "pipeline"
+        summary = self.summary()
+        if extra is not None:
+            summary["pipeline"] = extra
+        with open(path, "w") as file:
+            json.dump(summary, file, indent=4)
+
+    def exportCSV(self, path):
+        # One row per stage and one per counter
+        summary = self.summary()
+        columns = ["kind", "name", "count", "meanMs", "p95Ms", "maxMs", "totalMs"]
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=columns, restval="")
+            writer.writeheader()
+            for name, stage in summary["stages"].items():
+                writer.writerow({"kind": "stage", "name": name, **stage})
+            for name, count in summary["counters"].items():
+                writer.writerow({"kind": "counter", "name": name, "count": count})
+            writer.writerow({"kind": "session", "name": "fps", "meanMs": 1e3 / summary["fps"] if summary["fps"] else "",
+                             "count": summary["frames"]})
+
+    def export(self, path, extra=None):
+        # JSON or CSV by the file extension
+        if path.lower().endswith(".csv"):
+            self.exportCSV(path)
+        else:
+            self.exportJSON(path, extra)
+
+    def printSummary(self):
+        summary = self.summary()
+        print(f"Profile: {summary['frames']} frames, {summary['fps']:.1f} fps")
+        for name, stage in summary["stages"].items():
+            if "meanMs" in stage:
+                print(f"\t{name}: {stage['count']} calls, mean {stage['meanMs']:.2f} ms, "
+                      f"p95 {stage['p95Ms']:.2f} ms, max {stage['maxMs']:.2f} ms")
+        for name, count in sorted(summary["counters"].items()):
+            print(f"\t{name}: {count}")
+
+
+# The profiler guitarFunctions and the camera entry points report to
+profiler = Profiler()